@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the memory used by hydrated models, excluding the document values themselves.
+
+Usage::
+
+    python benchmarks/memory.py [fields] [models]
+"""
+import gc
+import sys
+import dibble.fields
+import dibble.model
+
+
+def make_model(nfields):
+    attrs = dict(('field{0}'.format(i), dibble.fields.Field()) for i in range(nfields))
+
+    return type('BenchmarkModel', (dibble.model.Model, ), attrs)
+
+
+def sizeof(obj, shared, seen=None):
+    """approximate number of bytes used by `obj` and all objects reachable from it, except for `shared` objects"""
+    seen = (set() if seen is None else seen)
+    stack = [obj]
+    size = 0
+
+    while stack:
+        o = stack.pop()
+
+        if id(o) in seen or id(o) in shared or isinstance(o, type):
+            continue
+
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+
+        else:
+            if hasattr(o, '__dict__'):
+                stack.append(o.__dict__)
+
+            for cls in type(o).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if slot not in ('__dict__', '__weakref__') and hasattr(o, slot):
+                        stack.append(getattr(o, slot))
+
+    return size
+
+
+def main(nfields=30, nmodels=1000):
+    model_class = make_model(nfields)
+    docs = [dict(('field{0}'.format(i), i) for i in range(nfields)) for _ in range(nmodels)]
+
+    # the document values are shared with the raw documents and not counted
+    shared = set(id(v) for v in docs[0].itervalues())
+    shared.update(id(k) for k in docs[0])
+    shared.update(id(x) for x in (None, True, False, dibble.fields.undefined, frozenset()))
+
+    gc.collect()
+    models = [model_class(doc) for doc in docs]
+    seen = set()
+    total = sum(sizeof(m, shared, seen) for m in models)
+
+    print '{0} fields, {1} models: {2:.0f} bytes per model'.format(nfields, nmodels, float(total) / nmodels)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+`dibble.cache` contains document caches for :class:`dibble.mapper.ModelMapper`.
+"""
+import collections
+import copy
+import threading
+import time
+
+
+class Cache(object):
+    """Interface for document caches used by :class:`~dibble.mapper.ModelMapper` to cache documents by `_id`.
+    Caches must return copies of the cached documents, as models modify their documents.
+    """
+    def get(self, key):
+        """return cached document for `key` or None if it is not cached"""
+        raise NotImplementedError()
+
+    def set(self, key, doc):
+        """cache document `doc` for `key`"""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """remove document for `key` from the cache"""
+        raise NotImplementedError()
+
+    def clear(self):
+        """remove all documents from the cache"""
+        raise NotImplementedError()
+
+
+class LRUCache(Cache):
+    """In-process :class:`Cache` with least-recently-used eviction and optional expiry of documents.
+
+    :param int maxsize: maximum number of cached documents
+    :param ttl: seconds after which cached documents expire, None to never expire documents
+    :param clock: function returning the current time in seconds
+    """
+    def __init__(self, maxsize=1000, ttl=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        #: number of successful lookups
+        self.hits = 0
+        #: number of failed lookups
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or (entry[0] is not None and entry[0] <= self.clock()):
+                self.misses += 1
+                return None
+
+            self._entries[key] = entry
+            self.hits += 1
+
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, doc):
+        expires = (self.clock() + self.ttl if self.ttl is not None else None)
+        entry = (expires, copy.deepcopy(doc))
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
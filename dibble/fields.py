@@ -2,8 +2,9 @@
 """
 """
 import collections
+import copy
 from dibble.operations import SetMixin, IncrementMixin, RenameMixin, UnsetMixin, PushMixin, PushAllMixin
-from dibble.operations import AddToSetMixin, PopMixin, PullMixin, PullAllMixin
+from dibble.operations import AddToSetMixin, PopMixin, PullMixin, PullAllMixin, locked
 
 
 class InvalidatedSubfieldError(Exception):
@@ -55,6 +56,7 @@ class BaseField(object):
     Handles default and initial values, field name and the :class:`dibble.model.Model` reference.
     """
     __metaclass__ = FieldMeta
+    __slots__ = ('_default', '_value', '_name', '_model', 'initial', '_owned')
 
     def __init__(self, default=undefined, _name=None, _initial=undefined, _model=undefined):
         self._default = default
@@ -62,6 +64,8 @@ class BaseField(object):
         self._name = _name
         self._model = _model
         self.initial = _initial
+        # True if _value is a list or dict created by this field, which can be modified in place
+        self._owned = False
 
     def __call__(self):
         return self.value
@@ -89,6 +93,7 @@ class BaseField(object):
 
         return (self._value if self.defined else None)
 
+    @locked
     def reset(self, value=unknown):
         """reset field to it's initial value or default value if no initial value was given. Can also be used to
         reset the field to a specified value that will be used as the new initial value for this field.
@@ -97,6 +102,7 @@ class BaseField(object):
         """
         if value is unknown:
             self._value = (self.initial if self.initial is not undefined else self.default)
+            self._owned = False
             self._model._update.drop_field(self.name)
 
         else:
@@ -105,10 +111,14 @@ class BaseField(object):
 
     def _setvalue(self, value):
         self._value = value
+        self._owned = False
 
     def _undefine(self):
         self._setvalue(undefined)
 
+    def _rename(self, name):
+        self._name = name
+
     def _reload(self, *arg, **kw):
         self._model.reload(*arg, **kw)
 
@@ -118,9 +128,12 @@ class Field(BaseField, SetMixin, IncrementMixin, RenameMixin, UnsetMixin, PushMi
     """:class:`Field` combines the low-level API provided by :class:`BaseField` with the higher-level operations from
     :mod:`dibble.operations`.
     """
+    __slots__ = ('_subfields', )
+
     def __init__(self, default=undefined, _name=None, _initial=undefined, _model=None):
         super(Field, self).__init__(default, _name, _initial, _model)
-        self._subfields = {}
+        # dict of subfields, created when the first subfield is requested
+        self._subfields = None
 
     def _setvalue(self, value):
         super(Field, self)._setvalue(value)
@@ -152,16 +165,30 @@ class Field(BaseField, SetMixin, IncrementMixin, RenameMixin, UnsetMixin, PushMi
             for key in invalidated_subfields:
                 self._subfields.pop(key)
 
+    def _rename(self, name):
+        super(Field, self)._rename(name)
+        self._reset_name()
+
+    def _reset_name(self):
+        # reset the cached names of all subfields
+        for field in (self._subfields or {}).itervalues():
+            field._reset_name()
+
+    @locked
     def reset(self, value=unknown):
         super(Field, self).reset(value)
 
-        if value is not unknown:
+        if value is unknown:
+            # resetting to a new value resets the subfields through the reset to the new initial value
             self._reset_subfields()
 
     reset.__doc__ = BaseField.reset.__doc__
 
     def subfield(self, key):
         """get a :class:`Subfield` for the given key"""
+        if self._subfields is None:
+            self._subfields = {}
+
         if key not in self._subfields:
             sf = Subfield(parent=self)
 
@@ -198,17 +225,28 @@ class Subfield(Field):
         subfield = field['subfield']
         subfield.set('foobar')
     """
+    __slots__ = ('parent', '_parents', '_path')
+
     def __init__(self, default=undefined, _name=None, _initial=undefined, _model=None, parent=None):
         super(Subfield, self).__init__(default=default, _name=_name, _initial=_initial, _model=_model)
         self.parent = parent
+        self._parents = self._collect_parents()
+        # dotted path of this subfield, computed on first access and reset when a parent is renamed
+        self._path = None
 
     @property
     def name(self):
-        return '{0}.{1}'.format('.'.join(x._name for x in reversed(self.parents)), self._name)
+        if self._path is None:
+            self._path = '{0}.{1}'.format('.'.join(x._name for x in reversed(self._parents)), self._name)
+
+        return self._path
 
     @property
     def parents(self):
-        """get list of parent fields of this subfield"""
+        """get tuple of parent fields of this subfield, starting with the nearest parent"""
+        return self._parents
+
+    def _collect_parents(self):
         parentlist = []
         field = self.parent
 
@@ -216,29 +254,58 @@ class Subfield(Field):
             parentlist.append(field)
             field = getattr(field, 'parent', None)
 
-        return parentlist
+        return tuple(parentlist)
+
+    def _reset_name(self):
+        self._path = None
+        super(Subfield, self)._reset_name()
 
     def _setvalue(self, value):
         if self.parent is None:
             raise InvalidatedSubfieldError('Subfield {0!r} was invalidated by an update to it\'s '
                                            'parent Field.'.format(self._name))
 
-        super(Subfield, self)._setvalue(value)
+        self._value = value
+        self._owned = False
 
-        parents = self.parents
-        parent, key, v = parents[0], self._name, value
+        if self._subfields:
+            self._reset_subfields()
+
+        parent = self.parent
+
+        # an owned parent value is a dict already stored in all ancestors, so it can be updated directly. Otherwise
+        # an ancestor was replaced or never modified through a subfield, and the value is propagated up the chain.
+        if parent._owned:
+            parent._value[self._name] = value
+
+        else:
+            self._propagate(value)
+
+    def _propagate(self, value):
+        parent, key, v = self.parent, self._name, value
 
         while parent is not None:
-            if parent.defined:
+            if parent.defined and parent._owned:
                 parent._value[key] = v
                 break
 
-            parent._value = v = {key: v}
+            if parent.defined:
+                # the value may be shared with a pending $set, so it is copied before the first modification
+                container = copy.copy(parent._value)
+                container[key] = v
+
+            else:
+                container = {key: v}
+
+            parent._value = v = container
+            parent._owned = True
             key = parent._name
             parent = getattr(parent, 'parent', None)
 
     def _invalidate(self):
         self.parent = None
+        self._parents = ()
+        self._path = None
         self._model = None
 
     @property
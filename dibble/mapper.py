@@ -1,20 +1,261 @@
 # -*- coding: utf-8 -*-
+import collections
+import contextlib
+import itertools
+import multiprocessing.pool
+import Queue
+import re
+import sys
+import threading
+import weakref
+from bson.regex import Regex
 from pymongo.cursor import Cursor as PymongoCursor
+from pymongo.errors import BulkWriteError
+from .model import ModelBase, ModelView, RELOAD_FIND_AND_MODIFY, RELOAD_LAZY
+
+_pattern_type = type(re.compile(''))
+
+
+def _spec_id(spec):
+    # return the _id of a query document selecting a single document by _id, else None. Operators, regular
+    # expressions, arrays and unhashable values do not select a single cacheable _id.
+    if isinstance(spec, dict) and len(spec) == 1 and '_id' in spec:
+        oid = spec['_id']
+
+        if not isinstance(oid, (dict, list, tuple, Regex, _pattern_type)) and _hashable(oid):
+            return oid
+
+    return None
+
+
+def _hashable(value):
+    try:
+        hash(value)
+
+    except TypeError:
+        return False
+
+    return True
+
+
+def _unapplied(count, error, ordered):
+    # indexes of the operations of a bulk write of `count` operations that were not applied according to the
+    # BulkWriteError `error`. Ordered bulk writes stop at the first failed operation.
+    failed = set(e['index'] for e in error.details.get('writeErrors', ()))
+
+    if ordered and failed:
+        return set(range(min(failed), count))
+
+    return failed
+
+
+def _range_spec(spec, key, lower, upper, first=False):
+    # query document for the documents matching `spec` with a `key` in the range [lower, upper). If `first` is set,
+    # documents lacking `key` or with values of other types are included, as they are not matched by any range.
+    if upper is not None and first:
+        cond = {'$not': {'$gte': upper}}
+
+    else:
+        cond = {}
+
+        if lower is not None:
+            cond['$gte'] = lower
+
+        if upper is not None:
+            cond['$lt'] = upper
+
+    if not cond:
+        return spec
+
+    return ({'$and': [spec, {key: cond}]} if spec else {key: cond})
+
+
+def _prefetch(ref, queue, stop):
+    # worker of prefetching cursors: puts lists of documents fetched by the cursor referenced by `ref` into `queue`
+    # until the cursor is exhausted, fails, is closed or garbage collected. An empty list marks the end.
+    while not stop.is_set():
+        cursor = ref()
+
+        if cursor is None:
+            break
+
+        try:
+            item = cursor._fetch_documents()
+
+        except Exception:
+            item = sys.exc_info()
+
+        # only keep a weak reference while waiting, so that abandoned cursors are collected and stop the worker
+        del cursor
+
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                break
+
+            except Queue.Full:
+                pass
+
+        if not isinstance(item, list) or not item:
+            break
 
 
 class ModelCursor(PymongoCursor):
-    """custom :class:`pymongo.cursor.Cursor` subclass that returns model instances"""
+    """custom :class:`pymongo.cursor.Cursor` subclass that returns model instances
+
+    :param mapper: :class:`ModelMapper` used to wrap the documents
+    :param readonly: return read-only :class:`~dibble.model.ModelView` instances instead of models
+    :param unloaded: names of fields excluded by the projection of the cursor
+    :param int prefetch: number of batches fetched ahead by a worker thread while the current batch is processed,
+                         0 disables prefetching
+    """
     def __init__(self, mapper, *arg, **kw):
+        readonly = kw.pop('readonly', False)
+        unloaded = kw.pop('unloaded', frozenset())
+        prefetch = kw.pop('prefetch', 0)
         super(ModelCursor, self).__init__(*arg, **kw)
         self.mapper = mapper
+        self.readonly = readonly
+        self.unloaded = unloaded
+        self.prefetch = prefetch
+        self._worker = None
+        self._queue = None
+        self._stop = None
+        self._prefetched = collections.deque()
+        self._prefetch_done = False
+
+    def _wrap(self, doc):
+        if self.readonly:
+            return self.mapper.view(doc)
+
+        return self.mapper._hydrate(doc, self.unloaded)
+
+    def _wrap_batch(self, docs):
+        if self.readonly:
+            return [self.mapper.view(doc) for doc in docs]
+
+        return self.mapper._hydrate_batch(docs, self.unloaded)
+
+    def _fetch_documents(self, size=None):
+        # take up to `size` (default: all) documents from the buffer of the cursor, fetching the next batch from the
+        # server if the buffer is empty. Returns an empty list if the cursor is exhausted.
+        data = self._Cursor__data
+
+        if self._Cursor__empty or not (len(data) or self._refresh()):
+            return []
+
+        count = (len(data) if size is None else min(size, len(data)))
+        docs = [data.popleft() for _ in xrange(count)]
+
+        if self._Cursor__manipulate:
+            collection = self._Cursor__collection
+            docs = [collection.database._fix_outgoing(doc, collection) for doc in docs]
+
+        return docs
+
+    def _next_documents(self, size=None):
+        # like _fetch_documents, but takes the documents from the prefetched batches if prefetching is enabled
+        if not self.prefetch:
+            return self._fetch_documents(size)
+
+        if not self._prefetched and not self._prefetch_done:
+            if self._worker is None:
+                self._queue = Queue.Queue(maxsize=self.prefetch)
+                self._stop = threading.Event()
+                self._worker = threading.Thread(target=_prefetch, args=(weakref.ref(self), self._queue, self._stop))
+                self._worker.daemon = True
+                self._worker.start()
+
+            item = self._queue.get()
+
+            if not isinstance(item, list):
+                self._prefetch_done = True
+                raise item[0], item[1], item[2]
+
+            self._prefetched.extend(item)
+            self._prefetch_done = not item
+
+        data = self._prefetched
+        count = (len(data) if size is None else min(size, len(data)))
+
+        return [data.popleft() for _ in xrange(count)]
+
+    def _stop_prefetch(self):
+        # stop the worker thread and discard prefetched documents
+        if self._worker is not None:
+            self._stop.set()
+
+            if self._worker is not threading.current_thread():
+                self._worker.join()
+
+            self._worker = self._queue = self._stop = None
+
+        self._prefetched.clear()
+        self._prefetch_done = False
+
+    def close(self):
+        """close the cursor, stopping a prefetching worker thread first"""
+        self._stop_prefetch()
+        super(ModelCursor, self).close()
+
+    def rewind(self):
+        """rewind the cursor to its unevaluated state, stopping a prefetching worker thread first"""
+        self._stop_prefetch()
+        return super(ModelCursor, self).rewind()
+
+    def __del__(self):
+        if getattr(self, '_stop', None) is not None:
+            self._stop.set()
+
+        super(ModelCursor, self).__del__()
 
     def __getitem__(self, key):
         doc = super(ModelCursor, self).__getitem__(key)
-        return self.mapper(doc)
+        return self._wrap(doc)
 
     def next(self):
+        if self.prefetch:
+            docs = self._next_documents(1)
+
+            if not docs:
+                raise StopIteration
+
+            return self._wrap(docs[0])
+
         doc = super(ModelCursor, self).next()
-        return self.mapper(doc)
+        return self._wrap(doc)
+
+    def iter_batches(self, size=None):
+        """iterate over lists of models (or views), hydrating the documents of each list at once. If the cursor was
+        not used yet and has no batch size, `size` is used as batch size so that each list is fetched from the
+        server in one batch.
+
+        Example usage::
+
+            for models in mapper.find().iter_batches(1000):
+                export(models)
+
+        :param int size: number of models per list, defaults to the documents of each batch received from the server
+        """
+        if size and self._Cursor__id is None and not self._Cursor__batch_size:
+            self.batch_size(size)
+
+        pending = []
+
+        while True:
+            docs = self._next_documents(size - len(pending) if size else None)
+
+            if not docs:
+                break
+
+            pending.extend(docs)
+
+            if not size or len(pending) >= size:
+                yield self._wrap_batch(pending)
+                pending = []
+
+        if pending:
+            yield self._wrap_batch(pending)
 
 
 class ModelMapper(object):
@@ -24,10 +265,24 @@ class ModelMapper(object):
 
     :param dibble.model.Model model: model class for documents in the collection
     :param pymongo.collection.Collection collection: underlying collection instance for data storage
+    :param reload_policy: reload policy for models of this mapper, overrides
+                          :attr:`dibble.model.Model.reload_policy` if given
+    :param dibble.cache.Cache cache: cache for documents retrieved by :meth:`find_one` with an `_id` query
+    :param dibble.writebehind.WriteBehind write_behind: buffer for the updates saved by models of this mapper
     """
-    def __init__(self, model, collection):
+    def __init__(self, model, collection, reload_policy=None, cache=None, write_behind=None):
         self.model = model
         self.collection = collection
+        self.reload_policy = reload_policy
+        self.cache = cache
+        self.write_behind = write_behind
+        self._local = threading.local()
+        # number of cache invalidations, guarded by _cache_lock
+        self._invalidations = 0
+        self._cache_lock = threading.Lock()
+
+        if write_behind is not None:
+            write_behind.bind(self)
 
     def __call__(self, *arg, **kw):
         """create a new model instance bound to this ModelMapper. The model's :meth:`dibble.model.Model.save` method
@@ -37,6 +292,93 @@ class ModelMapper(object):
         doc.bind(self)
         return doc
 
+    @property
+    def identity_map(self):
+        """identity map of the current :meth:`session` of this thread or None outside of sessions"""
+        return getattr(self._local, 'identity_map', None)
+
+    @contextlib.contextmanager
+    def session(self):
+        """context manager for a session with an identity map. Within the session, queries return the already
+        existing model instance for documents that were loaded before (identified by their `_id`) instead of
+        creating a new one. Models are only weakly referenced by the identity map. Sessions are local to the current
+        thread, nested sessions share the identity map of the outermost session.
+
+        Example usage::
+
+            with mapper.session():
+                assert mapper.find_one({'_id': oid}) is mapper.find_one({'_id': oid})
+        """
+        previous = self.identity_map
+        self._local.identity_map = (previous if previous is not None else weakref.WeakValueDictionary())
+
+        try:
+            yield self._local.identity_map
+
+        finally:
+            self._local.identity_map = previous
+
+    def _hydrate(self, doc, unloaded):
+        identity_map = self.identity_map
+
+        if identity_map is not None and not ('_id' in doc and _hashable(doc['_id'])):
+            # documents with unhashable _ids (like embedded documents) are not tracked by the identity map
+            identity_map = None
+
+        if identity_map is not None:
+            model = identity_map.get(doc['_id'])
+
+            if model is not None:
+                return model
+
+        model = self(doc)
+
+        if unloaded:
+            model._set_unloaded(unloaded)
+
+        if identity_map is not None:
+            identity_map[doc['_id']] = model
+
+        return model
+
+    def _hydrate_batch(self, docs, unloaded):
+        # the batched construction of models is skipped if subclasses create models differently
+        if self.identity_map is not None or type(self).__call__.__func__ is not ModelMapper.__call__.__func__:
+            return [self._hydrate(doc, unloaded) for doc in docs]
+
+        models = self.model._from_documents(docs, self)
+
+        if unloaded:
+            for model in models:
+                model._set_unloaded(unloaded)
+
+        return models
+
+    def _projection(self, only=None, exclude=None):
+        # build projection document and names of unloaded fields for `only` or `exclude` field names
+        if only is not None and exclude is not None:
+            raise ValueError('only and exclude cannot be used together')
+
+        # fields loaded only in part by dotted names count as unloaded, so that they are never saved or accessed
+        # with partial values
+        if only is not None:
+            loaded = set(name for name in only if '.' not in name)
+            loaded.add('_id')
+
+            return dict((name, 1) for name in only), self.model._field_names - loaded
+
+        if exclude is not None:
+            if '_id' in exclude:
+                raise ValueError('_id cannot be excluded')
+
+            return dict((name, 0) for name in exclude), frozenset(name.partition('.')[0] for name in exclude)
+
+        return None, frozenset()
+
+    def view(self, doc):
+        """create a read-only :class:`~dibble.model.ModelView` of `doc` for the :attr:`model`"""
+        return ModelView(self.model, doc)
+
     def count(self):
         """number of documents in the underlying :attr:`collection`"""
         return self.collection.count()
@@ -45,10 +387,25 @@ class ModelMapper(object):
         """find documents by spec, which is a MongoDB query document. Additional arguments will be passed to the
         :class:`ModelCursor` constructor.
 
+        Use `only` or `exclude` to load only some fields of the documents. Models keep track of the fields that
+        were not loaded: they are fetched when accessed (see :attr:`dibble.model.Model.fetch_unloaded`) and never
+        treated as unset. Dotted names load or exclude parts of a field: models treat such a field as not loaded and
+        fetch it completely when it is accessed, read-only views return the partial value.
+
         :param dict spec: MongoDB query document
+        :param readonly: return read-only :class:`~dibble.model.ModelView` instances instead of models
+        :param only: list of field names to load
+        :param exclude: list of field names not to load
+        :param int prefetch: number of batches to fetch ahead on a worker thread, see :class:`ModelCursor`
         :return: new `ModelCursor` instance with query results
         """
         spec = spec or {}
+        projection, unloaded = self._projection(kw.pop('only', None), kw.pop('exclude', None))
+
+        if projection is not None:
+            kw['fields'] = projection
+            kw['unloaded'] = unloaded
+
         kw.setdefault('slave_ok', self.collection.slave_okay)
         kw.setdefault('read_preference', self.collection.read_preference)
 
@@ -60,26 +417,357 @@ class ModelMapper(object):
 
         return ModelCursor(self, self.collection, spec, *args, **kw)
 
+    def parallel_scan(self, spec=None, partitions=4, workers=None, fn=list, key='_id', bounds=None, reducer=None,
+                      pool=None, **kw):
+        """scan the documents matching `spec` in `partitions` ranges of `key` in parallel, calling `fn` with a
+        :class:`ModelCursor` for each range on a thread pool. Additional keyword arguments are passed to :meth:`find`.
+
+        The range boundaries are sampled from the matching documents so that the partitions are of about equal size,
+        unless they are given as `bounds`. Sampling sorts by `key` on the server, so `key` must be indexed (as `_id`
+        always is) for large collections, otherwise pass `bounds`. Documents lacking `key` belong to the first
+        partition. The ranges compare values of the same type only: if the values of `key` have different types (e.g.
+        numbers and strings), the boundaries may have different types as well and documents can be left outside of
+        every range.
+
+        Example usage::
+
+            counts = mapper.parallel_scan({'active': True}, partitions=8, fn=count_logins, reducer=operator.add)
+
+        :param dict spec: MongoDB query document
+        :param int partitions: number of partitions
+        :param int workers: number of threads, defaults to `partitions`
+        :param fn: function called with the cursor of each partition
+        :param str key: (possibly dotted) name of the field used to partition the documents
+        :param bounds: sorted list of boundaries between the partitions
+        :param reducer: function of two results used to reduce the results of all partitions
+        :param pool: pool with an `imap` method (like :class:`multiprocessing.pool.ThreadPool`) to use instead of a
+                     new thread pool. The pool is not closed.
+        :return: iterator of the results of `fn` in partition order or their reduction if `reducer` is given
+        """
+        spec = spec or {}
+
+        if bounds is None:
+            bounds = self._partition_bounds(spec, partitions, key)
+
+        limits = [None] + list(bounds) + [None]
+        specs = [_range_spec(spec, key, lower, upper, first=(i == 0))
+                 for i, (lower, upper) in enumerate(zip(limits, limits[1:]))]
+
+        def scan(partition_spec):
+            return fn(self.find(partition_spec, **kw))
+
+        results = self._imap(scan, specs, workers or len(specs), pool)
+
+        if reducer is not None:
+            return reduce(reducer, results)
+
+        return results
+
+    def _imap(self, fn, items, workers, pool):
+        # iterate over the results of `fn` for all items computed on `pool` or a new thread pool
+        if pool is not None:
+            for result in pool.imap(fn, items):
+                yield result
+
+            return
+
+        pool = multiprocessing.pool.ThreadPool(workers)
+
+        try:
+            for result in pool.imap(fn, items):
+                yield result
+
+        finally:
+            pool.terminate()
+
+    def _partition_bounds(self, spec, partitions, key):
+        # values of `key` splitting the documents matching `spec` into partitions of about equal size. Each boundary
+        # is found by the server walking the index of `key`, only one document is transferred per boundary.
+        count = self.collection.find(spec).count()
+        fields = ({key: 1} if key == '_id' else {key: 1, '_id': 0})
+        bounds = []
+
+        for i in range(1, partitions):
+            cursor = self.collection.find(spec, fields=fields).sort(key, 1).skip(i * count // partitions).limit(1)
+            doc = next(iter(cursor), None)
+
+            for name in key.split('.'):
+                doc = (doc.get(name) if isinstance(doc, dict) else None)
+
+            if doc is not None and (not bounds or doc != bounds[-1]):
+                bounds.append(doc)
+
+        return bounds
+
+        fields = ({key: 1} if key == '_id' else {key: 1, '_id': 0})
+        last = max(targets)
+
+        for i, doc in enumerate(self.collection.find(spec, fields=fields).sort(key, 1)):
+            if i in targets:
+                for name in key.split('.'):
+                    doc = (doc.get(name) if isinstance(doc, dict) else None)
+
+                if doc is not None and (not bounds or doc != bounds[-1]):
+                    bounds.append(doc)
+
+                if i == last:
+                    break
+
+        return bounds
+
     def find_one(self, spec=None, *arg, **kw):
         """find first matching document by spec, which is a MongoDB query document. Additional arguments will be
         passt to the :meth:`~pymongo.Collection.find_one` method of the :attr:`collection`.
 
+        If the mapper has a :attr:`cache`, queries for a single `_id` without additional arguments are answered from
+        the cache. Documents are not cached if writes of this mapper invalidated the cache while they were queried,
+        writes of other mappers or processes are not tracked.
+
         :param dict spec: MongoDB query document
+        :param readonly: return a read-only :class:`~dibble.model.ModelView` instead of a model
+        :param only: list of field names to load, see :meth:`find`
+        :param exclude: list of field names not to load, see :meth:`find`
         :return: :attr:`model` instance or None if no matching document was found
         """
         spec = spec or {}
-        doc = self.collection.find_one(spec, *arg, **kw)
+        readonly = kw.pop('readonly', False)
+        projection, unloaded = self._projection(kw.pop('only', None), kw.pop('exclude', None))
+
+        if projection is not None:
+            kw['fields'] = projection
+
+        oid = (_spec_id(spec) if self.cache is not None and not arg and not kw else None)
+
+        if oid is not None:
+            doc = self.cache.get(oid)
 
-        return (self(doc) if doc is not None else None)
+            if doc is None:
+                invalidations = self._invalidations
+                doc = self.collection.find_one(spec)
+
+                if doc is not None:
+                    with self._cache_lock:
+                        # do not cache a document that may have been outdated by a concurrent write
+                        if invalidations == self._invalidations:
+                            self.cache.set(oid, doc)
+
+        else:
+            doc = self.collection.find_one(spec, *arg, **kw)
+
+        if doc is None:
+            return None
+
+        return (self.view(doc) if readonly else self._hydrate(doc, unloaded))
+
+    def find_and_modify(self, spec, doc, *arg, **kw):
+        """update a single document in :attr:`collection` matching query document `spec` with the updates in `doc`.
+        This method proxies :meth:`pymongo.Collection.find_and_modify`.
+
+        :param readonly: return a read-only :class:`~dibble.model.ModelView` instead of a model
+        :return: :attr:`model` instance of the returned document or None if no matching document was found
+        """
+        readonly = kw.pop('readonly', False)
+        doc = self.collection.find_and_modify(spec, doc, *arg, **kw)
+        self._invalidate(spec)
+
+        if doc is None:
+            return None
+
+        return (self.view(doc) if readonly else self(doc))
 
     def update(self, spec, doc, *arg, **kw):
         """update documents in :attr:`collection` matching query document `spec` with the updates in `doc`.
         This method proxies :meth:`pymongo.Collection.update`
         """
-        return self.collection.update(spec, doc, *arg, **kw)
+        result = self.collection.update(spec, doc, *arg, **kw)
+        self._invalidate(spec)
+        return result
 
     def save(self, doc, *arg, **kw):
         """save document `doc` into the collection
         This method proxies :meth:`pymongo.Collection.save`
         """
-        return self.collection.save(doc, *arg, **kw)
+        oid = self.collection.save(doc, *arg, **kw)
+        self._invalidate({'_id': oid})
+        return oid
+
+    def _invalidate(self, spec):
+        # remove documents matching `spec` from the cache
+        if self.cache is not None:
+            oid = _spec_id(spec)
+
+            with self._cache_lock:
+                self._invalidations += 1
+
+                if oid is not None:
+                    self.cache.delete(oid)
+
+                else:
+                    self.cache.clear()
+
+    def save_all(self, models, **kw):
+        """save all `models` with a single batched insert for new models and a single bulk update for modified
+        models. Models are bound to this mapper and their updates are cleared. Keyword arguments are used as write
+        concern for both operations.
+
+        Models using the :data:`~dibble.model.RELOAD_FIND_AND_MODIFY` reload policy are reloaded lazily, as bulk
+        updates do not return the updated documents. If a model has several update documents, the bulk update is
+        ordered so they are applied in sequence.
+
+        If the bulk update fails with a :exc:`~pymongo.errors.BulkWriteError`, the updates that were not applied are
+        put back on their models, so that they can be saved again. After other errors it is unknown which updates
+        were applied: they are dropped and the models are reloaded completely on their next access.
+
+        :param models: iterable of :attr:`model` instances
+        :return: list of ObjectIds of the saved models in the order of `models`
+        """
+        inserts, updates = [], []
+        saved = []
+        ordered = False
+
+        for model in models:
+            policy, pending = self._begin_batch_save(model)
+
+            if model.is_new:
+                inserts.append(model._take_document())
+                saved.append((model, policy, None, None))
+
+            else:
+                upd = (model._take_updates() if model._update.dirty else [])
+                spec = {'_id': model._id.value}
+                updates.extend((model, spec, doc) for doc in upd)
+                ordered = ordered or len(upd) > 1
+                saved.append((model, policy, pending, upd))
+
+        try:
+            oids = (self.collection.insert(inserts, **kw) if inserts else [])
+
+        except Exception:
+            self._restore_batch(saved)
+            raise
+
+        # inserted documents are on the server now, so their models are finished even if the bulk update fails
+        oids = iter(oids)
+
+        for model, policy, pending, upd in saved:
+            if upd is None:
+                model._id.reset(next(oids))
+                model._end_save(policy, pending)
+
+        if updates:
+            bulk = (self.collection.initialize_ordered_bulk_op() if ordered else
+                    self.collection.initialize_unordered_bulk_op())
+
+            for _, spec, upd in updates:
+                bulk.find(spec).update_one(upd)
+
+            try:
+                bulk.execute(kw or None)
+
+            except BulkWriteError as e:
+                self._restore_unapplied(saved, updates, _unapplied(len(updates), e, ordered))
+                raise
+
+            except Exception:
+                # which updates were applied is unknown, so they are not restored but reloaded
+                for model, policy, pending, upd in saved:
+                    if upd:
+                        model._end_save(RELOAD_LAZY, None)
+
+                for _, spec, _ in updates:
+                    self._invalidate(spec)
+
+                raise
+
+            for _, spec, _ in updates:
+                self._invalidate(spec)
+
+        result = []
+
+        for model, policy, pending, upd in saved:
+            if upd is not None:
+                model._end_save(policy, pending, upd)
+
+            result.append(model._id.value)
+
+        return result
+
+    def _restore_batch(self, saved):
+        # put back the update documents of the modified models of a failed save_all
+        for model, _, _, upd in saved:
+            if upd:
+                model._restore_updates(upd)
+
+    def _restore_unapplied(self, saved, updates, unapplied):
+        # put back the update documents of a partially failed bulk update of save_all that were not applied, the
+        # applied ones are saved
+        failed, applied = collections.defaultdict(list), collections.defaultdict(list)
+
+        for i, (model, spec, doc) in enumerate(updates):
+            if i in unapplied:
+                failed[id(model)].append(doc)
+
+            else:
+                applied[id(model)].append(doc)
+                self._invalidate(spec)
+
+        for model, policy, pending, upd in saved:
+            if upd:
+                if id(model) in failed:
+                    model._restore_updates(failed[id(model)])
+
+                model._end_save(policy, pending, applied[id(model)])
+
+    def insert_many(self, docs, batch_size=1000, **kw):
+        """insert models or plain documents from the iterable `docs` as new documents, using batched inserts of up to
+        `batch_size` documents. `docs` is consumed batch by batch, so it may be an unbounded generator. Models are
+        bound to this mapper and get their `_id` field set. Keyword arguments are passed to
+        :meth:`pymongo.Collection.insert`.
+
+        :param docs: iterable of :attr:`model` instances or dicts
+        :param int batch_size: maximum number of documents per insert
+        :return: number of inserted documents
+        """
+        docs = iter(docs)
+        count = 0
+
+        while True:
+            batch = list(itertools.islice(docs, batch_size))
+
+            if not batch:
+                break
+
+            payload, saved = [], []
+
+            for doc in batch:
+                if isinstance(doc, ModelBase):
+                    policy, _ = self._begin_batch_save(doc)
+                    saved.append((doc, policy))
+                    doc = doc._take_document()
+
+                else:
+                    saved.append(None)
+
+                payload.append(doc)
+
+            oids = self.collection.insert(payload, **kw)
+
+            for model_policy, oid in zip(saved, oids):
+                if model_policy is not None:
+                    model, policy = model_policy
+                    model._id.reset(oid)
+                    model._end_save(policy, None)
+
+            count += len(batch)
+
+        return count
+
+    def _begin_batch_save(self, model):
+        # bind model for saving in a batch, findAndModify cannot be used for batches
+        model.bind(self)
+        policy = model._get_reload_policy()
+
+        if policy == RELOAD_FIND_AND_MODIFY:
+            policy = RELOAD_LAZY
+
+        return policy, model._begin_save()
@@ -1,9 +1,86 @@
 # -*- coding: utf-8 -*-
+import collections
+import threading
 import pymongo
 from . import fields
 from .update import Update
 
 
+#: never reload models implicitly
+RELOAD_NEVER = 'never'
+#: reload models on the next field access after they were saved
+RELOAD_LAZY = 'lazy'
+#: update existing documents with findAndModify and load the returned document when saving
+RELOAD_FIND_AND_MODIFY = 'find_and_modify'
+
+RELOAD_POLICIES = (RELOAD_NEVER, RELOAD_LAZY, RELOAD_FIND_AND_MODIFY)
+
+# keyword arguments of save setting the write concern, findAndModify is always acknowledged
+_WRITE_CONCERN_ARGS = frozenset(['safe', 'w', 'j', 'fsync', 'wtimeout'])
+
+
+class _NoLock(object):
+    # context manager used instead of a lock by models which are not thread-safe
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_lock = _NoLock()
+
+
+def _update_paths(updates):
+    # names of all (possibly dotted) fields touched by a list of update documents
+    paths = set()
+
+    for update in updates:
+        for op, values in update.items():
+            paths.update(values)
+
+            if op == '$rename':
+                paths.update(values.values())
+
+    return paths
+
+
+def _collapse_paths(paths):
+    # sorted paths without those below another of the paths, as e.g. 'foo' already includes 'foo.a'
+    paths = set(paths)
+    collapsed = []
+
+    for path in paths:
+        keys = path.split('.')
+
+        if not any('.'.join(keys[:i]) in paths for i in range(1, len(keys))):
+            collapsed.append(path)
+
+    return sorted(collapsed)
+
+
+def _merge_paths(value, doc, paths):
+    # copy of `value` where each dotted path is replaced by its value in `doc` or removed if `doc` lacks it
+    merged = (dict(value) if isinstance(value, collections.Mapping) else {})
+
+    for path in paths:
+        keys = path.split('.')
+        src, dst = doc, merged
+
+        for key in keys[:-1]:
+            src = (src.get(key, {}) if isinstance(src, collections.Mapping) else {})
+            child = dst.get(key)
+            dst[key] = dst = (dict(child) if isinstance(child, collections.Mapping) else {})
+
+        if isinstance(src, collections.Mapping) and keys[-1] in src:
+            dst[keys[-1]] = src[keys[-1]]
+
+        else:
+            dst.pop(keys[-1], None)
+
+    return merged
+
+
 class ModelError(Exception):
     """base class for all model related errors"""
     pass
@@ -19,52 +96,277 @@ class UnsavedModelError(ModelError):
     pass
 
 
+class UnloadedFieldError(ModelError):
+    """raised when accessing a field that was excluded by a projection and is not fetched on access"""
+    pass
+
+
 class UndefinedFieldError(KeyError):
     """raised when trying to access an undefined field"""
     pass
 
 
+class FieldDescriptor(object):
+    """
+    Class attribute replacing an :class:`~dibble.fields.UnboundField` on a model class. Returns the
+    :class:`~dibble.fields.UnboundField` when accessed on the class and binds the field to the model instance when it
+    is accessed on an instance that has not bound it yet.
+    """
+    def __init__(self, name, field):
+        self.name = name
+        self.field = field
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.field
+
+        if self.name in instance._deleted:
+            raise AttributeError('{0!r} object has no attribute {1!r}'.format(owner, self.name))
+
+        return instance._bind(self.name, self.field)
+
+
+class ModelMeta(type):
+    """
+    MetaClass of :class:`ModelBase`. Collects the :class:`~dibble.fields.UnboundField` instances of a model class
+    (including inherited ones) once at class creation, so that model instances do not have to search for them.
+    """
+    def __init__(cls, name, bases, attrs):
+        super(ModelMeta, cls).__init__(name, bases, attrs)
+
+        for k, v in attrs.items():
+            if isinstance(v, fields.UnboundField):
+                type.__setattr__(cls, k, FieldDescriptor(k, v))
+
+        cls._collect_fields()
+
+    def __setattr__(cls, key, value):
+        if isinstance(value, fields.UnboundField):
+            value = FieldDescriptor(key, value)
+
+        super(ModelMeta, cls).__setattr__(key, value)
+        cls._refresh_fields()
+
+    def __delattr__(cls, key):
+        super(ModelMeta, cls).__delattr__(key)
+        cls._refresh_fields()
+
+    def _collect_fields(cls):
+        unbound = {}
+        mixed_in = set()
+
+        for klass in reversed(cls.__mro__):
+            for k, v in vars(klass).items():
+                if isinstance(v, FieldDescriptor):
+                    unbound[k] = v.field
+                    mixed_in.discard(k)
+
+                elif isinstance(v, fields.UnboundField):
+                    # fields of mixins which are not model classes
+                    unbound[k] = v
+                    mixed_in.add(k)
+
+                else:
+                    # subclasses may replace fields with other attributes
+                    unbound.pop(k, None)
+                    mixed_in.discard(k)
+
+        for k in mixed_in:
+            type.__setattr__(cls, k, FieldDescriptor(k, unbound[k]))
+
+        type.__setattr__(cls, '_unbound_fields', tuple(sorted(unbound.items())))
+        type.__setattr__(cls, '_field_names', frozenset(unbound))
+
+    def _refresh_fields(cls):
+        cls._collect_fields()
+
+        for subclass in cls.__subclasses__():
+            subclass._refresh_fields()
+
+
 class ModelBase(object):
     """base class for all dibble models"""
+    __metaclass__ = ModelMeta
+
+    #: keep the initial document and bind fields on first access instead of binding all fields on creation
+    lazy_fields = False
+
+    #: how the model is refreshed after :meth:`save`, one of :data:`RELOAD_NEVER`, :data:`RELOAD_LAZY` or
+    #: :data:`RELOAD_FIND_AND_MODIFY`. Can be overridden by the :attr:`~dibble.mapper.ModelMapper.reload_policy` of
+    #: the mapper.
+    reload_policy = RELOAD_LAZY
+
+    #: protect field operations and :meth:`save` with a lock, so that models can be modified by several threads.
+    #: Operations recorded while a save is in progress are saved by the next save.
+    thread_safe = False
+
+    #: fetch fields excluded by a projection when they are accessed. If False, accessing them raises
+    #: :class:`UnloadedFieldError`.
+    fetch_unloaded = True
+
     _id = fields.Field()
 
+    # names of fields deleted from an instance
+    _deleted = frozenset()
+
+    _lock = None
+
     def __init__(self, *arg, **kw):
-        initial = dict(*arg, **kw)
-        self._update = Update()
-        self._fields = {}
-        self._mapper = None
-        self._requires_reload = False
+        self._setup(dict(*arg, **kw))
 
-        for k in dir(self):
-            # lookup in class to avoid triggering property evaluation
-            v = getattr(self.__class__, k, None)
+    def _setup(self, initial, mapper=None):
+        # initialize model with document `initial`, which is kept by lazy models
+        vars(self).update(_update=Update(), _fields={}, _mapper=mapper, _requires_reload=False, _reload_paths=None,
+                          _unloaded=frozenset(), _raw=None)
 
-            if isinstance(v, fields.UnboundField):
-                field = getattr(self, k)
+        if self.thread_safe:
+            self._lock = threading.RLock()
 
-                if k in initial:
-                    bound = field.bind(k, self, initial[k])
+        if self.lazy_fields:
+            self._raw = initial
+            return
 
-                else:
-                    bound = field.bind(k, self)
+        for k, field in self._unbound_fields:
+            self._bind_value(k, field, initial.get(k, fields.undefined))
+
+    @classmethod
+    def _from_documents(cls, docs, mapper):
+        # create models bound to `mapper` for documents that are not used elsewhere (e.g. a batch of query results).
+        # The argument handling of __init__ is skipped unless a subclass overrides it.
+        if cls.__init__.__func__ is not ModelBase.__init__.__func__:
+            return [mapper(doc) for doc in docs]
+
+        models = []
 
-                setattr(self, k, bound)
-                self._fields[k] = bound
+        for doc in docs:
+            model = cls.__new__(cls)
+            model._setup(doc, mapper)
+            models.append(model)
+
+        return models
 
     def __iter__(self):
-        for name, field in self._fields.iteritems():
+        pending = []
+
+        if self._raw is not None:
+            for name, field in self._unbound_fields:
+                if not self._is_bound(name) and name not in self._unloaded:
+                    if name in self._raw:
+                        pending.append(name)
+
+                    else:
+                        # fields without data may still have a default value
+                        self._bind(name, field)
+
+        for name, field in self._fields.items():
             if field.defined:
                 yield (name, field.value)
 
+        if pending:
+            self.reload(force=False)
+
+        for name in pending:
+            if not self._is_bound(name) and name in self._raw:
+                yield (name, self._raw[name])
+
+            else:
+                try:
+                    field = self._getfield(name)
+
+                except KeyError:
+                    continue
+
+                if field.defined:
+                    yield (name, field.value)
+
+    def _bind(self, name, field):
+        if name in self._unloaded:
+            self._load_unloaded()
+
+            return getattr(self, name)
+
+        if self._raw is not None:
+            return self._bind_value(name, field, self._raw.pop(name, fields.undefined))
+
+        return self._bind_value(name, field, fields.undefined)
+
+    def _bind_value(self, name, field, initial):
+        bound = field.bind(name, self, initial)
+        self._fields[name] = bound
+        super(ModelBase, self).__setattr__(name, bound)
+
+        return bound
+
+    def _set_unloaded(self, names):
+        # mark fields that were excluded by a projection, they are loaded on their first access
+        self._unloaded = frozenset(names)
+
+        for name in self._unloaded:
+            if self._fields.pop(name, None) is not None:
+                del self.__dict__[name]
+
+            if self._raw is not None:
+                # drop partial values loaded by dotted projections
+                self._raw.pop(name, None)
+
+    def _load_unloaded(self):
+        if not self.fetch_unloaded:
+            raise UnloadedFieldError('Fields {0!r} were not loaded.'.format(sorted(self._unloaded)))
+
+        if not self._mapper:
+            raise UnboundModelError()
+
+        names = sorted(self._unloaded)
+        view = self._mapper.find_one({'_id': self._id.value}, fields=names,
+                                     read_preference=pymongo.ReadPreference.PRIMARY, readonly=True)
+        doc = (view._doc if view is not None else {})
+        self._unloaded = frozenset()
+
+        for name, field in self._unbound_fields:
+            if name in names and not self._is_bound(name):
+                if self._raw is not None:
+                    if name in doc:
+                        self._raw[name] = doc[name]
+
+                else:
+                    self._bind_value(name, field, doc.get(name, fields.undefined))
+
+    def _is_bound(self, name):
+        # True if field `name` was bound to or deleted from this instance
+        return name in self.__dict__ or name in self._deleted
+
+    def _getfield(self, name):
+        field = self._fields.get(name)
+
+        if field is None:
+            if self._is_bound(name) or not isinstance(getattr(self.__class__, name, None), fields.UnboundField):
+                raise KeyError(name)
+
+            field = getattr(self, name)
+
+        return field
+
     def __delattr__(self, item):
+        if item not in self._fields and (self._raw is not None or item in self._unloaded):
+            try:
+                self._getfield(item)
+
+            except KeyError:
+                pass
+
         if item in self._fields:
             del self._fields[item]
-            setattr(self, item, None)
+            super(ModelBase, self).__delattr__(item)
+            # the field descriptor raises AttributeError for deleted fields
+            self._deleted = self._deleted | frozenset([item])
 
         else:
             super(ModelBase, self).__delattr__(item)
 
     def __setattr__(self, key, value):
+        if key in self._deleted:
+            self._deleted = self._deleted - frozenset([key])
+
         if isinstance(value, fields.BaseField) and key not in self._fields:
             self._fields[key] = value
 
@@ -74,19 +376,11 @@ class ModelBase(object):
 
         super(ModelBase, self).__setattr__(key, value)
 
-    def __getattribute__(self, item):
-        v = super(ModelBase, self).__getattribute__(item)
-
-        if v is None and isinstance(getattr(self.__class__, item, None), fields.UnboundField):
-            raise AttributeError('{0!r} object has no attribute {1!r}'.format(type(self), item))
-
-        return v
-
     def __getitem__(self, key):
-        field = self._fields[key]
+        field = self._getfield(key)
 
         if field.defined:
-            return self._fields[key].value
+            return field.value
 
         raise UndefinedFieldError('Field {0!r} is not defined.'.format(key))
 
@@ -105,59 +399,257 @@ class ModelBase(object):
         self._mapper = mapper
 
     def reload(self, force=True):
-        """reload model from the database if necessary
+        """reload model from the database if necessary. Implicit reloads after :meth:`save` only fetch and reset the
+        fields touched by the saved updates.
 
-         :param force: reload model even if unnecessary
+         :param force: reload the complete model even if unnecessary
          """
-        if self._requires_reload or force:
+        with self._locked():
+            if not (self._requires_reload or force):
+                return
+
             if not self._mapper:
                 raise UnboundModelError()
 
             if not self._id.defined:
                 raise UnsavedModelError()
 
-            new = self._mapper.find_one({'_id': self._id.value}, read_preference=pymongo.ReadPreference.PRIMARY)
+            spec = {'_id': self._id.value}
+
+            if force or self._reload_paths is None:
+                new = self._mapper.find_one(spec, read_preference=pymongo.ReadPreference.PRIMARY, readonly=True)
+                self._load(new._doc, keep_pending=not force)
+
+            else:
+                paths = _collapse_paths(self._reload_paths)
+                new = self._mapper.find_one(spec, fields=paths, read_preference=pymongo.ReadPreference.PRIMARY,
+                                            readonly=True)
+                self._load_paths(new._doc, paths)
+
+            self._requires_reload = False
+            self._reload_paths = None
+
+    def _load(self, doc, keep_pending=False):
+        # reset fields to their values in document `doc`. With `keep_pending`, fields with operations recorded since
+        # the last save (e.g. by other threads while saving) keep their values, the next save reloads them.
+        for name, field in self._fields.items():
+            if name in self._field_names and not (keep_pending and self._update.touches(name)):
+                field.reset(doc.get(name, fields.undefined))
+
+        if self._raw is not None:
+            self._raw = dict((k, v) for k, v in doc.iteritems() if k not in self._fields)
+
+    def _load_paths(self, doc, paths):
+        # reset the fields of the given (possibly dotted) paths to their values in document `doc`. Fields with
+        # operations recorded since the last save keep their values, like with `keep_pending` of _load.
+        subpaths = collections.defaultdict(set)
+
+        for path in paths:
+            name, _, subpath = path.partition('.')
+            subpaths[name].add(subpath)
+
+        for name, fieldpaths in subpaths.items():
+            if self._update.touches(name):
+                continue
+
+            if name in self._fields:
+                current = self._fields[name]._value
+
+            elif self._raw is not None and not self._is_bound(name):
+                current = self._raw.get(name, fields.undefined)
+
+            else:
+                continue
+
+            if '' in fieldpaths:
+                value = doc.get(name, fields.undefined)
+
+            elif name in doc or current is not fields.undefined:
+                value = _merge_paths(current, doc.get(name, {}), fieldpaths)
+
+            else:
+                value = fields.undefined
+
+            if name in self._fields:
+                self._fields[name].reset(value)
+
+            elif value is fields.undefined:
+                self._raw.pop(name, None)
 
-            for name, field in new._fields.items():
-                if name in self._fields:
-                    self._fields[name].reset(field._value)
+            else:
+                self._raw[name] = value
 
+    def _get_reload_policy(self):
+        policy = getattr(self._mapper, 'reload_policy', None) or self.reload_policy
+
+        if policy not in RELOAD_POLICIES:
+            raise ValueError('Unknown reload policy: {0!r}'.format(policy))
+
+        return policy
+
+    def _begin_save(self):
+        # returns the paths of a pending reload (None for complete reloads) and prevents reloads while saving
+        with self._locked():
+            pending = (self._reload_paths if self._requires_reload else frozenset())
             self._requires_reload = False
 
+            return pending
+
+    def _locked(self):
+        # context manager holding the lock of thread-safe models
+        return (self._lock if self._lock is not None else _no_lock)
+
+    def _take_updates(self):
+        # atomically take the pending update documents. Operations recorded by other threads meanwhile are saved by
+        # the next save.
+        with self._locked():
+            return self._update.take()
+
+    def _take_document(self):
+        # atomically take the complete document of a new model and clear the pending updates it includes
+        with self._locked():
+            doc = dict(self)
+            self._update.clear()
+
+            return doc
+
+    def _restore_updates(self, updates):
+        # put back update documents taken by _take_updates if saving them failed
+        with self._locked():
+            self._update.restore(updates)
+
+    def _end_save(self, policy, pending, updates=None):
+        # schedule the reload of the pending paths and those touched by the update documents in `updates` (None for
+        # complete reloads)
+        if pending is not None and updates:
+            pending = pending | _update_paths(updates)
+
+        if policy == RELOAD_LAZY:
+            with self._locked():
+                self._reload_paths = pending
+                self._requires_reload = (pending is None or bool(pending))
+
     def save(self, *arg, **kw):
         """Save model data to database. Requires the model to be bound to a mapper first. Additional arguments
-        will be passed to :meth:`~dibble.mapper.ModelMapper.save` method of the mapper.
+        will be passed to :meth:`~dibble.mapper.ModelMapper.save` method of the mapper (or
+        :meth:`~dibble.mapper.ModelMapper.find_and_modify` for existing documents if the reload policy is
+        :data:`RELOAD_FIND_AND_MODIFY`, which takes no positional arguments and ignores write concern arguments as
+        findAndModify is always acknowledged). Updates which could not be merged into a single update document are
+        sent one after another. If the mapper has a :attr:`~dibble.mapper.ModelMapper.write_behind` buffer, updates of
+        existing documents are added to the buffer instead, which does not accept additional arguments.
         """
         if not self._mapper:
             raise UnboundModelError()
 
-        self._requires_reload = False
+        write_behind = getattr(self._mapper, 'write_behind', None)
+
+        if write_behind is not None and not self.is_new:
+            if arg or kw:
+                raise ValueError('save arguments are not supported for buffered updates, '
+                                 'set the write concern of the WriteBehind buffer instead')
+
+            if self._update.dirty:
+                updates = self._take_updates()
+
+                try:
+                    write_behind.add(self._id.value, updates)
+
+                except Exception:
+                    self._restore_updates(updates)
+                    raise
+
+            return self._id.value
+
+        policy = self._get_reload_policy()
+        pending = self._begin_save()
+        updates = None
 
         if self.is_new:
-            doc = dict(self)
+            doc = self._take_document()
 
             if '_id' in kw:
                 doc['_id'] = kw.pop('_id')
 
             oid = self._mapper.save(doc, *arg, **kw)
             self._id.reset(oid)
+            pending = None
 
         else:
-            doc = dict(self)
-            upd = dict(self._update)
-            oid = doc.get('_id', None)
+            oid = self._id.value
 
             # do not perform update with empty update document as
             # this would overwrite/clear existing data
-            if upd:
-                self._mapper.update({'_id': oid}, upd, *arg, **kw)
+            if self._update.dirty:
+                updates = self._take_updates()
+
+                try:
+                    if policy == RELOAD_FIND_AND_MODIFY:
+                        for upd in updates[:-1]:
+                            self._mapper.update({'_id': oid}, upd, *arg, **kw)
 
-        self._update.clear()
-        self._requires_reload = True
+                        fam_kw = dict((k, v) for k, v in kw.iteritems() if k not in _WRITE_CONCERN_ARGS)
+                        fam_kw.setdefault('new', True)
+                        new = self._mapper.find_and_modify({'_id': oid}, updates[-1], readonly=True, **fam_kw)
+
+                        if new is not None:
+                            with self._locked():
+                                self._load(new._doc, keep_pending=True)
+
+                    else:
+                        for upd in updates:
+                            self._mapper.update({'_id': oid}, upd, *arg, **kw)
+
+                except Exception:
+                    self._restore_updates(updates)
+                    raise
+
+        self._end_save(policy, pending, updates)
 
         return oid
 
 
+class ModelView(object):
+    """Read-only view of a document for a model class. Views provide the dict-like read access of a model for all
+    fields of the model class, but skip the creation of :class:`~dibble.fields.Field` instances, update tracking and
+    reloading. Values are returned as stored in the document, field defaults are not applied.
+
+    :param model: model class describing the document
+    :param dict doc: document data
+    """
+    __slots__ = ('model', '_doc')
+
+    def __init__(self, model, doc):
+        self.model = model
+        self._doc = doc
+
+    def __getitem__(self, key):
+        if key not in self.model._field_names:
+            raise KeyError(key)
+
+        try:
+            return self._doc[key]
+
+        except KeyError:
+            raise UndefinedFieldError('Field {0!r} is not defined.'.format(key))
+
+    def __iter__(self):
+        doc = self._doc
+
+        for name in self.model._field_names:
+            if name in doc:
+                yield (name, doc[name])
+
+    def __contains__(self, key):
+        return (key in self.model._field_names and key in self._doc)
+
+    def __repr__(self):
+        return '<{0}View({1!r})>'.format(self.model.__name__, dict(self))
+
+    def get(self, key, default=None):
+        """return value of field `key` if it is defined, else `default`"""
+        return (self._doc[key] if key in self else default)
+
+
 class Model(ModelBase):
     """A Model describes the structure of a MongoDB document. It consists of :class:`~dibble.field.Field` instances
     which can then be used to manipulate the document data.
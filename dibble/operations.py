@@ -17,17 +17,75 @@ class DuplicateFieldError(KeyError):
     pass
 
 
+def _key(value):
+    # MongoDB does not consider booleans equal to numbers
+    return ((bool, value) if isinstance(value, bool) else value)
+
+
+class ItemSet(object):
+    """Membership index for list items with MongoDB equality semantics. Hashable items are looked up in a set, other
+    items (like dicts and lists) are compared one by one.
+    """
+    def __init__(self, items=()):
+        self._hashed = set()
+        self._unhashable = []
+
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        try:
+            return _key(item) in self._hashed
+
+        except TypeError:
+            return item in self._unhashable
+
+    def add(self, item):
+        try:
+            self._hashed.add(_key(item))
+
+        except TypeError:
+            self._unhashable.append(item)
+
+
+def locked(fn):
+    """decorator calling the wrapped method with the lock of thread-safe models held"""
+    @functools.wraps(fn)
+    def wrapper(self, *arg, **kw):
+        lock = getattr(self._model, '_lock', None)
+
+        if lock is None:
+            return fn(self, *arg, **kw)
+
+        with lock:
+            return fn(self, *arg, **kw)
+
+    return wrapper
+
+
 def reloading(fn):
-    """decorator that automatically reloads the model if necessary before calling the wrapped method"""
+    """decorator that automatically reloads the model if necessary before calling the wrapped method. The method is
+    called with the lock of thread-safe models held.
+    """
     @functools.wraps(fn)
     def wrapper(self, *arg, **kw):
-        self._reload(force=False)
-        return fn(self, *arg, **kw)
+        lock = getattr(self._model, '_lock', None)
+
+        if lock is None:
+            self._reload(force=False)
+            return fn(self, *arg, **kw)
+
+        # thread-safe models serialize all operations
+        with lock:
+            self._reload(force=False)
+            return fn(self, *arg, **kw)
 
     return wrapper
 
 
 class SetMixin(object):
+    __slots__ = ()
+
     @reloading
     def set(self, value):
         """set field to new value
@@ -39,6 +97,8 @@ class SetMixin(object):
 
 
 class IncrementMixin(object):
+    __slots__ = ()
+
     @reloading
     def inc(self, increment):
         """add `increment` to field value"""
@@ -52,6 +112,9 @@ class IncrementMixin(object):
 
 
 class RenameMixin(object):
+    __slots__ = ()
+
+    @locked
     def rename(self, new):
         """rename field to name given by `new`"""
         f = getattr(self._model, self.name, None)
@@ -64,7 +127,7 @@ class RenameMixin(object):
                 oldname = self.name
                 delattr(self._model, self.name)
                 setattr(self._model, new, f)
-                f._name = new
+                f._rename(new)
                 self._model._update.rename(oldname, new)
 
         else:
@@ -72,6 +135,8 @@ class RenameMixin(object):
 
 
 class UnsetMixin(object):
+    __slots__ = ()
+
     @reloading
     def unset(self):
         """unset this field"""
@@ -86,53 +151,75 @@ class UnsetMixin(object):
 
 
 class PushMixin(object):
+    __slots__ = ()
+
     @reloading
     def push(self, value):
         """append `value` to the current value of the field. Will fail if current field value is not a list."""
-        if self.defined:
-            self._setvalue(self._value + [value])
+        if self._owned:
+            self._value.append(value)
 
         else:
-            self._setvalue([value])
+            # copy the list once, as it might be shared with the initial value or the default
+            self._setvalue((self._value + [value]) if self.defined else [value])
+            self._owned = True
 
         self._model._update.push(self.name, value)
 
 
 class PushAllMixin(object):
+    __slots__ = ()
+
     @reloading
     def push_all(self, values):
         """append all values to the current value of the field. Will fail is current field value is not a list"""
-        if self.defined:
-            self._setvalue(self._value + values)
+        if self._owned:
+            self._value.extend(values)
 
         else:
-            self._setvalue(values[:])
+            self._setvalue((self._value + values) if self.defined else values[:])
+            self._owned = True
 
         self._model._update.pushAll(self.name, values)
 
 
 class AddToSetMixin(object):
+    __slots__ = ()
+
     @reloading
     def add_to_set(self, value):
         """append value to the current value of the field if it is not already in the list. Will fail is current field
         value is not a list
         """
-        newvalue = (self._value[:] if self.defined else [])
+        if self._owned:
+            newvalue = self._value
+
+        else:
+            newvalue = (self._value[:] if self.defined else [])
 
         if isinstance(value, collections.Mapping) and ('$each' in value):
-            for v in value['$each']:
-                if v not in newvalue:
-                    newvalue.append(v)
+            items = value['$each']
 
         else:
-            if value not in newvalue:
-                newvalue.append(value)
+            items = [value]
+
+        present = ItemSet(newvalue)
+
+        for v in items:
+            if v not in present:
+                newvalue.append(v)
+                present.add(v)
+
+        if newvalue is not self._value:
+            self._setvalue(newvalue)
+            self._owned = True
 
-        self._setvalue(newvalue)
         self._model._update.addToSet(self.name, value)
 
 
 class PopMixin(object):
+    __slots__ = ()
+
     @reloading
     def pop(self, first=False):
         """remove last (or first) item from current field value list. Will fail is current field value is not a list.
@@ -149,6 +236,8 @@ class PopMixin(object):
 
 
 class PullMixin(object):
+    __slots__ = ()
+
     @reloading
     def pull(self, value):
         """remove an item by `value` from current field value list. Will fail is current field value is not a list."""
@@ -156,15 +245,21 @@ class PullMixin(object):
             raise NotImplementedError('using pull() with a match criteria is not supported')
 
         elif self._value:
-            self._setvalue([x for x in self._value if x != value])
+            key = _key(value)
+            self._setvalue([x for x in self._value if _key(x) != key])
+            self._owned = True
 
         self._model._update.pull(self.name, value)
 
 
 class PullAllMixin(object):
+    __slots__ = ()
+
     @reloading
     def pull_all(self, values):
         """remove each item in `values` from current field value list. Will fail is current field value is not a
         list."""
-        self._setvalue([x for x in self._value if (x not in values)])
+        pulled = ItemSet(values)
+        self._setvalue([x for x in self._value if (x not in pulled)])
+        self._owned = True
         self._model._update.pullAll(self.name, values)
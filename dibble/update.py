@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import collections
+import copy
+import numbers
+from dibble.operations import ItemSet
 
 
 class InvalidOperatorError(ValueError):
@@ -17,6 +20,13 @@ class FieldDict(dict):
 
         super(FieldDict, self).__setitem__(k, v)
 
+    def replace(self, k, v):
+        """replace value of field `k`, which must already be set"""
+        if k not in self:
+            raise KeyError(k)
+
+        super(FieldDict, self).__setitem__(k, v)
+
     def update(self, E=None, **F):
         raise NotImplementedError()
 
@@ -38,33 +48,465 @@ class OperatorDict(collections.defaultdict):
         raise NotImplementedError()
 
 
+def _each(value):
+    # list of items added by a $push or $addToSet value or None if the value uses modifiers besides $each
+    if isinstance(value, collections.Mapping) and '$each' in value:
+        return (list(value['$each']) if len(value) == 1 else None)
+
+    return [value]
+
+
+def _union(values, items):
+    # append items not yet contained in list `values`
+    present = ItemSet(values)
+
+    for item in items:
+        if item not in present:
+            values.append(item)
+            present.add(item)
+
+    return values
+
+
+class _PathNode(object):
+    __slots__ = ('ops', 'children')
+
+    def __init__(self):
+        self.ops = set()
+        self.children = {}
+
+
+class PathTrie(object):
+    """Trie of the dotted field paths touched by an update document, mapping each path to the operators touching it.
+    Looking up a path or its nearest touched ancestor takes O(depth) steps.
+    """
+    __slots__ = ('_root', )
+
+    def __init__(self):
+        self._root = _PathNode()
+
+    def __nonzero__(self):
+        return bool(self._root.children)
+
+    def add(self, path, op):
+        node = self._root
+
+        for key in path.split('.'):
+            node = node.children.setdefault(key, _PathNode())
+
+        node.ops.add(op)
+
+    def discard(self, path, op):
+        nodes = [self._root]
+
+        for key in path.split('.'):
+            node = nodes[-1].children.get(key)
+
+            if node is None:
+                return
+
+            nodes.append(node)
+
+        nodes[-1].ops.discard(op)
+
+        # prune nodes which neither are touched nor have touched descendants
+        for key, node, parent in reversed(zip(path.split('.'), nodes[1:], nodes)):
+            if node.ops or node.children:
+                break
+
+            del parent.children[key]
+
+    def get(self, path):
+        """set of operators touching exactly `path`"""
+        node = self._node(path)
+        return (node.ops if node is not None else frozenset())
+
+    def ancestor(self, path):
+        """nearest touched ancestor of `path` as (path, operators) tuple or None"""
+        keys = path.split('.')
+        node = self._root
+
+        for i, key in enumerate(keys[:-1]):
+            node = node.children.get(key)
+
+            if node is None:
+                return None
+
+            if node.ops:
+                return ('.'.join(keys[:i + 1]), node.ops)
+
+        return None
+
+    def has_descendants(self, path):
+        """whether a path below `path` is touched"""
+        node = self._node(path)
+        return node is not None and bool(node.children)
+
+    def items(self, path):
+        """list of (path, operators) tuples of `path` and all touched paths below it"""
+        result = []
+        stack = [(path, self._node(path))]
+
+        while stack:
+            prefix, node = stack.pop()
+
+            if node is None:
+                continue
+
+            if node.ops:
+                result.append((prefix, node.ops))
+
+            stack.extend((prefix + '.' + key, child) for key, child in node.children.iteritems())
+
+        return result
+
+    def _node(self, path):
+        node = self._root
+
+        for key in path.split('.'):
+            node = node.children.get(key)
+
+            if node is None:
+                return None
+
+        return node
+
+
+_missing = object()
+
+
 class Update(object):
+    """Collects the atomic update operations of a model. Repeated operations on the same field are merged where
+    possible: `$inc` increments are summed up, `$push`, `$pushAll`, `$addToSet` and `$pullAll` values are combined,
+    `$set` and `$unset` replace earlier operations on the field and its subfields and operations following a `$set`
+    on the field or one of its parents are applied to the value of the `$set`. Operations which cannot be merged,
+    including operations on overlapping paths that MongoDB would reject, start a new update document, so that they
+    are applied in order.
+
+    >>> update = Update()
+    >>> update.inc('foo', 1)
+    >>> update.inc('foo', 2)
+    >>> update.pop('foo')
+    >>> update.documents()
+    [{'$inc': {'foo': 3}}, {'$pop': {'foo': 1}}]
+
+    >>> update = Update()
+    >>> update.set('foo', {'bar': 1})
+    >>> update.inc('foo.bar', 1)
+    >>> update.documents()
+    [{'$set': {'foo': {'bar': 2}}}]
+    """
+    __slots__ = ('_docs', '_index', '_paths', '_merged')
+
     def __init__(self):
-        self._ops = OperatorDict()
+        self.clear()
 
     def __iter__(self):
-        return self._ops.iteritems()
+        """iterate over the operators of the first update document"""
+        return (self._docs[0].iteritems() if self._docs else iter(()))
 
     def __contains__(self, item):
-        return any(item in fields for _, fields in self._ops.items())
+        return self._index is not None and item in self._index
+
+    def touches(self, field):
+        """True if operations were recorded for `field` or one of its subfields"""
+        prefix = field + '.'
+
+        return bool(self._index) and any(name == field or name.startswith(prefix) for name in self._index)
+
+    @property
+    def dirty(self):
+        """True if any operations were recorded"""
+        return bool(self._index)
+
+    def documents(self):
+        """list of update documents to apply in order"""
+        return [dict(ops) for ops in self._docs if ops]
+
+    def take(self):
+        """return the update documents to apply in order and clear the update"""
+        docs = self.documents()
+        self.clear()
+
+        return docs
+
+    def restore(self, docs):
+        """put update documents returned by :meth:`take` back in front of the operations recorded since"""
+        pending = self.take()
+        self.merge(docs)
+        self.merge(pending)
+
+    def merge(self, docs):
+        """record the operations of the update documents `docs` after the operations of this update"""
+        for doc in docs:
+            for op, updates in doc.iteritems():
+                for field, value in updates.iteritems():
+                    self._record(op, field, value)
 
     def clear(self):
-        self._ops.clear()
+        # the update documents and their indexes are created when the first operation is recorded
+        self._docs = []
+        # maps each field to the (update document, operator) pairs of its operations
+        self._index = None
+        # paths touched by the last update document
+        self._paths = None
+        # (operator, field) pairs of the last update document whose values were created by merging operations and
+        # may be modified in place
+        self._merged = None
 
     def drop_field(self, field):
-        empty_keys = []
+        entries = (self._index.pop(field, None) if self._index else None)
+
+        if not entries:
+            return
+
+        last = self._docs[-1]
+
+        for ops, op in entries:
+            value = ops[op].pop(field)
+
+            if not ops[op]:
+                del ops[op]
+
+            if ops is last:
+                self._merged.discard((op, field))
+                self._paths.discard(field, op)
+
+                if op == '$rename':
+                    self._paths.discard(value, op)
+
+        if all(self._docs):
+            return
+
+        self._docs = [ops for ops in self._docs if ops]
+
+        if not self._docs:
+            self.clear()
+
+        elif self._docs[-1] is not last:
+            self._paths = PathTrie()
+            self._merged = set()
+
+            for k, updates in self._docs[-1].iteritems():
+                for name, value in updates.iteritems():
+                    self._paths.add(name, k)
+
+                    if k == '$rename':
+                        self._paths.add(value, k)
+
+    def _record(self, op, field, value):
+        if not self._docs or not self._combine(self._docs[-1], op, field, value):
+            self._add(self._new_document(), op, field, value)
+
+    def _new_document(self):
+        ops = OperatorDict()
+        self._docs.append(ops)
+        self._paths = PathTrie()
+        self._merged = set()
 
-        for k, updates in self._ops.iteritems():
-            updates.pop(field, None)
+        if self._index is None:
+            self._index = {}
 
-            if not updates:
-                empty_keys.append(k)
+        return ops
 
-        for k in empty_keys:
-            del self._ops[k]
+    def _add(self, ops, op, field, value):
+        ops[op][field] = value
+        self._index.setdefault(field, []).append((ops, op))
+        self._paths.add(field, op)
+
+        if op == '$rename':
+            self._paths.add(value, op)
+
+    def _remove(self, ops, op, field):
+        del ops[op][field]
+        self._merged.discard((op, field))
+        self._paths.discard(field, op)
+
+        entries = [x for x in self._index[field] if x[0] is not ops or x[1] != op]
+
+        if entries:
+            self._index[field] = entries
+
+        else:
+            del self._index[field]
+
+        if not ops[op]:
+            del ops[op]
+
+    def _combine(self, ops, op, field, value):
+        # add operation to the update document `ops`, combining it with operations on the same or overlapping paths.
+        # Returns False if that is not possible.
+        paths = self._paths
+
+        if op == '$rename':
+            for path in (field, value):
+                if paths.ancestor(path) is not None or paths.get(path) or paths.has_descendants(path):
+                    return False
+
+            self._add(ops, op, field, value)
+            return True
+
+        ancestor = paths.ancestor(field)
+
+        if ancestor is not None:
+            path, touched = ancestor
+            return touched == set(['$set']) and self._fold(ops['$set'], op, path, value,
+                                                           field[len(path) + 1:].split('.'))
+
+        touched = paths.get(field)
+
+        if op in ('$set', '$unset'):
+            overlapping = paths.items(field)
+
+            if any('$rename' in path_ops for _, path_ops in overlapping):
+                return False
+
+            for path, path_ops in overlapping:
+                for k in list(path_ops):
+                    self._remove(ops, k, path)
+
+            self._add(ops, op, field, value)
+            return True
+
+        if paths.has_descendants(field):
+            return False
+
+        if not touched:
+            self._add(ops, op, field, value)
+            return True
+
+        if touched == set([op]):
+            return self._merge(ops[op], op, field, value)
+
+        if touched == set(['$set']):
+            return self._fold(ops['$set'], op, field, value)
+
+        return False
+
+    def _merge(self, fields, op, field, value):
+        # merge operation into an operation of the same type
+        key = (op, field)
+        old = fields[field]
+
+        if op == '$inc':
+            fields.replace(field, old + value)
+
+        elif op in ('$push', '$addToSet'):
+            items = _each(value)
+
+            if items is None:
+                return False
+
+            if key not in self._merged:
+                old = _each(old)
+
+                if old is None:
+                    return False
+
+                fields.replace(field, {'$each': old})
+                self._merged.add(key)
+
+            if op == '$push':
+                fields[field]['$each'].extend(items)
+
+            else:
+                _union(fields[field]['$each'], items)
+
+        elif op in ('$pushAll', '$pullAll'):
+            if key in self._merged:
+                old.extend(value)
+
+            else:
+                fields.replace(field, old + value)
+                self._merged.add(key)
+
+        else:
+            return False
+
+        return True
+
+    def _fold(self, fields, op, field, value, subpath=()):
+        # apply operation on `field` or on the path `subpath` below it to the value of the $set operation of `field`
+        key = ('$set', field)
+        target = fields[field]
+
+        # check whether the operation can be applied before modifying anything
+        current = target
+
+        for name in subpath:
+            if not isinstance(current, collections.Mapping):
+                return False
+
+            current = current.get(name, _missing)
+
+        if op in ('$push', '$addToSet'):
+            items = _each(value)
+
+        elif op == '$pushAll':
+            items = value
+
+        elif op in ('$inc', '$set', '$unset'):
+            items = ()
+
+        else:
+            return False
+
+        if items is None:
+            return False
+
+        if op == '$inc':
+            if current is not _missing and not isinstance(current, numbers.Number):
+                return False
+
+        elif op not in ('$set', '$unset'):
+            if current is not _missing and not isinstance(current, list):
+                return False
+
+        if subpath:
+            # values added to the $set value may be modified by later operations
+            value, items = copy.deepcopy((value, items))
+
+            if key not in self._merged:
+                target = copy.deepcopy(target)
+
+            container = target
+
+            for name in subpath[:-1]:
+                container = container.setdefault(name, {})
+
+            leaf = subpath[-1]
+
+        else:
+            if key not in self._merged and isinstance(target, list):
+                target = target[:]
+
+            container, leaf = {field: target}, field
+
+        if op == '$set':
+            container[leaf] = value
+
+        elif op == '$unset':
+            container.pop(leaf, None)
+
+        elif op == '$inc':
+            container[leaf] = container.get(leaf, 0) + value
+
+        else:
+            values = container.setdefault(leaf, [])
+
+            if op == '$addToSet':
+                _union(values, items)
+
+            else:
+                values.extend(items)
+
+        fields.replace(field, (target if subpath else container[leaf]))
+        self._merged.add(key)
+
+        return True
 
     def set(self, field, value):
-        self._ops['$set'][field] = value
+        self._record('$set', field, value)
 
     def inc(self, field, increment):
         """
@@ -73,7 +515,7 @@ class Update(object):
         >>> dict(update)
         {'$inc': {'foo': 'bar'}}
         """
-        self._ops['$inc'][field] = increment
+        self._record('$inc', field, increment)
 
     def rename(self, old, new):
         """
@@ -82,26 +524,44 @@ class Update(object):
         >>> dict(update)
         {'$rename': {'old': 'new'}}
         """
-        self._ops['$rename'][old] = new
+        self._record('$rename', old, new)
 
     def unset(self, name):
-        self._ops['$unset'][name] = 1
+        self._record('$unset', name, 1)
 
     def push(self, name, value):
-        self._ops['$push'][name] = value
+        """
+        Repeated pushes to the same field are merged using `$each`:
+
+        >>> update = Update()
+        >>> update.push('foo', 1)
+        >>> update.push('foo', 2)
+        >>> dict(update)
+        {'$push': {'foo': {'$each': [1, 2]}}}
+        """
+        self._record('$push', name, value)
 
     def pushAll(self, name, values):
-        self._ops['$pushAll'][name] = values
+        """
+        Repeated pushes to the same field are merged:
+
+        >>> update = Update()
+        >>> update.pushAll('foo', [1, 2])
+        >>> update.pushAll('foo', [3])
+        >>> dict(update)
+        {'$pushAll': {'foo': [1, 2, 3]}}
+        """
+        self._record('$pushAll', name, values)
 
     def addToSet(self, name, value):
-        self._ops['$addToSet'][name] = value
+        self._record('$addToSet', name, value)
 
     def pop(self, name, first=False):
         v = (-1 if first else 1)
-        self._ops['$pop'][name] = v
+        self._record('$pop', name, v)
 
     def pull(self, name, value):
-        self._ops['$pull'][name] = value
+        self._record('$pull', name, value)
 
     def pullAll(self, name, values):
-        self._ops['$pullAll'][name] = values
+        self._record('$pullAll', name, values)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+`dibble.writebehind` contains the write-behind buffer for :class:`dibble.mapper.ModelMapper`.
+"""
+import atexit
+import collections
+import threading
+import weakref
+from pymongo.errors import BulkWriteError
+from .mapper import _unapplied
+from .update import Update
+
+
+def _close_at_exit(ref):
+    buf = ref()
+
+    if buf is not None:
+        buf.close()
+
+
+class WriteBehind(object):
+    """Buffer collecting the updates saved by models of a :class:`~dibble.mapper.ModelMapper` in memory instead of
+    writing them immediately. Updates of the same document are merged (e.g. increments are summed up) and written as
+    a single bulk operation when :meth:`flush` is called, when `max_pending` documents have pending updates or every
+    `interval` seconds by a background thread. If a flush fails with a :exc:`~pymongo.errors.BulkWriteError`, the
+    updates that were not applied are kept and retried by the next flush. After other errors it is unknown which
+    updates were applied, so they are dropped instead of being applied twice.
+
+    Until they are flushed, buffered updates are not visible to queries. Models saved with a write-behind mapper are
+    not reloaded after :meth:`~dibble.model.Model.save`, which raises :exc:`ValueError` for additional arguments
+    (like a write concern) of buffered saves. New models are inserted immediately.
+
+    Example usage::
+
+        mapper = ModelMapper(Stats, db.stats, write_behind=WriteBehind(max_pending=1000, interval=5))
+        stats = mapper.find_one({'_id': today})
+        stats.hits.inc(1)
+        stats.save()  # buffered
+
+    :param int max_pending: number of documents with pending updates that triggers a flush
+    :param interval: seconds between flushes of the background thread, None to disable it
+    :param bool flush_at_exit: close the buffer (flushing pending updates) when the interpreter exits
+    :param write_concern: write concern for the bulk updates
+    """
+    def __init__(self, max_pending=1000, interval=1.0, flush_at_exit=True, **write_concern):
+        self.max_pending = max_pending
+        self.interval = interval
+        self.write_concern = write_concern
+        self.mapper = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+        if flush_at_exit:
+            atexit.register(_close_at_exit, weakref.ref(self))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def bind(self, mapper):
+        """bind this buffer to a :class:`~dibble.mapper.ModelMapper`. Usually this is handled by the mapper"""
+        self.mapper = mapper
+
+        if self.interval is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def add(self, oid, updates):
+        """buffer the update documents `updates` for the document with `_id` `oid`"""
+        with self._lock:
+            # checked under the lock, so that no update is added after the final flush of close
+            if self._closed:
+                raise ValueError('WriteBehind buffer is closed')
+
+            update = self._pending.get(oid)
+
+            if update is None:
+                update = self._pending[oid] = Update()
+
+            update.merge(updates)
+            full = len(self._pending) >= self.max_pending
+
+        if full:
+            if self._thread is not None:
+                self._wakeup.set()
+
+            else:
+                self.flush()
+
+    def flush(self):
+        """write all pending updates
+
+        :return: number of updated documents
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            if not pending:
+                return 0
+
+            docs = [(oid, update.documents()) for oid, update in pending.iteritems()]
+            ops = [(oid, upd) for oid, updates in docs for upd in updates]
+            ordered = len(ops) > len(docs)
+            collection = self.mapper.collection
+            bulk = (collection.initialize_ordered_bulk_op() if ordered else collection.initialize_unordered_bulk_op())
+
+            for oid, upd in ops:
+                bulk.find({'_id': oid}).update_one(upd)
+
+            try:
+                bulk.execute(self.write_concern or None)
+
+            except BulkWriteError as e:
+                unapplied = _unapplied(len(ops), e, ordered)
+                failed = collections.OrderedDict()
+
+                for i, (oid, upd) in enumerate(ops):
+                    if i in unapplied:
+                        failed.setdefault(oid, []).append(upd)
+
+                    else:
+                        self.mapper._invalidate({'_id': oid})
+
+                self._restore(failed.items())
+                raise
+
+            except Exception:
+                # it is unknown which updates were applied, retrying them could apply them twice
+                for oid, _ in docs:
+                    self.mapper._invalidate({'_id': oid})
+
+                raise
+
+            for oid, _ in docs:
+                self.mapper._invalidate({'_id': oid})
+
+            return len(docs)
+
+    def close(self):
+        """stop the background thread and flush pending updates. Further updates are rejected."""
+        with self._lock:
+            self._closed = True
+
+        if self._thread is not None:
+            self._wakeup.set()
+
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+
+            self._thread = None
+
+        if self.mapper is not None:
+            self.flush()
+
+    def _restore(self, docs):
+        # put back the updates of a failed flush in front of the updates buffered since
+        with self._lock:
+            for oid, updates in docs:
+                update = self._pending.get(oid)
+
+                if update is None:
+                    update = self._pending[oid] = Update()
+                    update.merge(updates)
+
+                else:
+                    update.restore(updates)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+            if self._closed:
+                break
+
+            try:
+                self.flush()
+
+            except Exception:
+                # the updates were restored and are retried by the next flush
+                pass
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from nose.tools import eq_, assert_true
+import dibble.cache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lrucache_get_set():
+    cache = dibble.cache.LRUCache()
+    cache.set('foo', {'_id': 'foo', 'bar': 1})
+
+    eq_(cache.get('foo'), {'_id': 'foo', 'bar': 1})
+    eq_(cache.get('bar'), None)
+    eq_(cache.hits, 1)
+    eq_(cache.misses, 1)
+
+
+def test_lrucache_copies():
+    cache = dibble.cache.LRUCache()
+    doc = {'_id': 'foo', 'bar': [1]}
+    cache.set('foo', doc)
+    doc['bar'].append(2)
+
+    cached = cache.get('foo')
+    cached['bar'].append(3)
+
+    eq_(cache.get('foo'), {'_id': 'foo', 'bar': [1]})
+
+
+def test_lrucache_eviction():
+    cache = dibble.cache.LRUCache(maxsize=2)
+    cache.set('a', {'_id': 'a'})
+    cache.set('b', {'_id': 'b'})
+    cache.get('a')
+    cache.set('c', {'_id': 'c'})
+
+    eq_(len(cache), 2)
+    eq_(cache.get('b'), None)
+    assert_true(cache.get('a') is not None)
+    assert_true(cache.get('c') is not None)
+
+
+def test_lrucache_ttl():
+    clock = FakeClock()
+    cache = dibble.cache.LRUCache(ttl=10, clock=clock)
+    cache.set('a', {'_id': 'a'})
+
+    clock.now = 9
+    eq_(cache.get('a'), {'_id': 'a'})
+
+    clock.now = 10
+    eq_(cache.get('a'), None)
+    eq_(len(cache), 0)
+
+
+def test_lrucache_delete_clear():
+    cache = dibble.cache.LRUCache()
+    cache.set('a', {'_id': 'a'})
+    cache.set('b', {'_id': 'b'})
+    cache.delete('a')
+
+    eq_(cache.get('a'), None)
+    eq_(len(cache), 1)
+
+    cache.clear()
+
+    eq_(len(cache), 0)
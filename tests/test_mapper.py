@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import gc
+import re
 import pymongo
+import dibble.cache
 import dibble.fields
 import dibble.model
 import dibble.mapper
@@ -113,6 +116,314 @@ def test_find_getitem():
     eq_(db_user['name'], dummy_user['name'])
 
 
+@with_setup(setup_db)
+def test_find_readonly():
+    users = get_mapper()
+    uid = users.save({'name': 'test', 'other': 'foo'})
+
+    view = list(users.find({'name': 'test'}, readonly=True))[0]
+
+    assert isinstance(view, dibble.model.ModelView)
+    eq_(dict(view), {'_id': uid, 'name': 'test'})
+
+
+@with_setup(setup_db)
+def test_find_iter_batches():
+    users = get_mapper()
+    users.insert_many({'name': 'user{0}'.format(i)} for i in range(5))
+
+    batches = list(users.find().sort('name').iter_batches(2))
+
+    eq_([len(b) for b in batches], [2, 2, 1])
+    eq_([m.name.value for b in batches for m in b], ['user0', 'user1', 'user2', 'user3', 'user4'])
+    assert all(m._mapper is users for b in batches for m in b)
+
+    views = [v for b in users.find(readonly=True).iter_batches() for v in b]
+    eq_(len(views), 5)
+    assert isinstance(views[0], dibble.model.ModelView)
+
+
+@with_setup(setup_db)
+def test_find_prefetch():
+    users = get_mapper()
+    users.insert_many({'name': 'user{0}'.format(i)} for i in range(10))
+
+    models = list(users.find(prefetch=2).sort('name').batch_size(3))
+    eq_([m.name.value for m in models], ['user{0}'.format(i) for i in range(10)])
+
+    cursor = users.find(prefetch=1).batch_size(2)
+    eq_(len(next(cursor.iter_batches())), 2)
+    cursor.close()
+
+    assert cursor._worker is None
+    assert not cursor.alive
+
+
+@with_setup(setup_db)
+def test_parallel_scan():
+    users = get_mapper()
+    users.insert_many({'name': 'user{0}'.format(i)} for i in range(20))
+
+    def names(cursor):
+        return [m.name.value for m in cursor]
+
+    results = list(users.parallel_scan(partitions=4, workers=2, fn=names))
+
+    eq_(len(results), 4)
+    eq_(sorted(n for r in results for n in r), sorted('user{0}'.format(i) for i in range(20)))
+
+    eq_(users.parallel_scan({'name': {'$ne': 'user0'}}, partitions=3, fn=lambda c: c.count(True),
+                            reducer=lambda a, b: a + b), 19)
+    eq_(users.parallel_scan(partitions=2, key='name', bounds=['user2'], fn=lambda c: c.count(True),
+                            reducer=lambda a, b: a + b), 20)
+
+
+class SortedCollection(object):
+    """answers queries with its documents sorted by a single key and counts the transferred documents"""
+    def __init__(self, docs):
+        self.docs = docs
+        self.transferred = 0
+
+    def find(self, spec, fields=None):
+        return SortedCursor(self, fields)
+
+
+class SortedCursor(object):
+    def __init__(self, collection, fields):
+        self.collection = collection
+        self.fields = fields
+        self.docs = collection.docs
+
+    def count(self):
+        return len(self.docs)
+
+    def sort(self, key, direction):
+        self.docs = sorted(self.docs, key=lambda doc: doc.get(key))
+        return self
+
+    def skip(self, n):
+        self.docs = self.docs[n:]
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def __iter__(self):
+        for doc in self.docs:
+            self.collection.transferred += 1
+            yield dict((k, v) for k, v in doc.iteritems() if self.fields.get(k, k == '_id'))
+
+
+def test_partition_bounds():
+    collection = SortedCollection([{'_id': i, 'n': i // 2, 'x': i} for i in range(20)])
+    mapper = dibble.mapper.ModelMapper(UserModel, collection)
+
+    eq_(mapper._partition_bounds({}, 4, 'n'), [2, 5, 7])
+    eq_(collection.transferred, 3)
+    eq_(mapper._partition_bounds({}, 1, '_id'), [])
+
+
+@with_setup(setup_db)
+def test_find_one_readonly():
+    users = get_mapper()
+    uid = users.save({'name': 'test'})
+
+    view = users.find_one({'_id': uid}, readonly=True)
+
+    assert isinstance(view, dibble.model.ModelView)
+    eq_(view['name'], 'test')
+    eq_(users.find_one({'_id': 'unknown'}, readonly=True), None)
+
+
+@with_setup(setup_db)
+def test_find_only():
+    db = get_db()
+    users = dibble.mapper.ModelMapper(AdvancedUserModel, db.user)
+    uid = users.save({'logincount': 1, 'username': 'foo', 'usernames': ['foo', 'bar']})
+
+    user = users.find_one({'_id': uid}, only=['logincount'])
+
+    eq_(user._unloaded, frozenset(['username', 'usernames']))
+    eq_(dict(user), {'_id': uid, 'logincount': 1})
+
+    user.logincount.inc(1)
+    user.save()
+
+    eq_(users.collection.find_one({'_id': uid})['usernames'], ['foo', 'bar'])
+    eq_(user.usernames.value, ['foo', 'bar'])
+    eq_(user._unloaded, frozenset())
+
+
+@with_setup(setup_db)
+def test_find_exclude():
+    db = get_db()
+    users = dibble.mapper.ModelMapper(AdvancedUserModel, db.user)
+    uid = users.save({'logincount': 1, 'username': 'foo', 'usernames': ['foo', 'bar']})
+
+    user = list(users.find({'_id': uid}, exclude=['usernames']))[0]
+
+    eq_(user._unloaded, frozenset(['usernames']))
+    eq_(dict(user), {'_id': uid, 'logincount': 1, 'username': 'foo'})
+    eq_(user['usernames'], ['foo', 'bar'])
+
+
+@with_setup(setup_db)
+def test_find_only_dotted():
+    db = get_db()
+    mapper = dibble.mapper.ModelMapper(ReloadTestModel, db.reloadtest)
+    oid = mapper.save({'counter': 1, 'foo': {'a': 1, 'b': 2}})
+
+    m = mapper.find_one({'_id': oid}, only=['foo.a'])
+
+    eq_(m._unloaded, frozenset(['counter', 'foo', 'bar']))
+    eq_(m.foo.value, {'a': 1, 'b': 2})
+
+    m.foo.set({'a': 3})
+    m.save()
+
+    eq_(mapper.collection.find_one({'_id': oid}), {'_id': oid, 'counter': 1, 'foo': {'a': 3}})
+
+
+@with_setup(setup_db)
+def test_find_exclude_dotted():
+    db = get_db()
+    mapper = dibble.mapper.ModelMapper(ReloadTestModel, db.reloadtest)
+    oid = mapper.save({'counter': 1, 'foo': {'a': 1, 'b': 2}})
+
+    m = list(mapper.find({'_id': oid}, exclude=['foo.b']))[0]
+
+    eq_(m._unloaded, frozenset(['foo']))
+    eq_(dict(m), {'_id': oid, 'counter': 1})
+    eq_(m['foo'], {'a': 1, 'b': 2})
+
+
+@with_setup(setup_db)
+@raises(ValueError)
+def test_find_only_exclude():
+    users = get_mapper()
+    users.find_one(only=['name'], exclude=['name'])
+
+
+@with_setup(setup_db)
+def test_session_identity_map():
+    users = get_mapper()
+    uid = users.save({'name': 'test'})
+
+    assert users.find_one({'_id': uid}) is not users.find_one({'_id': uid})
+
+    with users.session() as identity_map:
+        user = users.find_one({'_id': uid})
+
+        assert users.find_one({'_id': uid}) is user
+        assert list(users.find({'_id': uid}))[0] is user
+
+        with users.session() as nested:
+            assert nested is identity_map
+
+        del user
+        gc.collect()
+
+        eq_(len(identity_map), 0)
+
+    eq_(users.identity_map, None)
+
+
+class ConcurrentWriteCollection(object):
+    """simulates a write of another thread invalidating the document while it is queried"""
+    def __init__(self):
+        self.mapper = None
+
+    def find_one(self, spec, *arg, **kw):
+        doc = {'_id': spec['_id'], 'name': 'old'}
+        self.mapper._invalidate(spec)
+
+        return doc
+
+
+def test_find_one_cache_concurrent_invalidation():
+    cache = dibble.cache.LRUCache()
+    users = dibble.mapper.ModelMapper(UserModel, ConcurrentWriteCollection(), cache=cache)
+    users.collection.mapper = users
+
+    eq_(users.find_one({'_id': 'foo'}).name.value, 'old')
+    eq_(len(cache), 0)
+
+
+class SingleDocumentCollection(object):
+    """answers every query with the same document"""
+    def __init__(self, doc):
+        self.doc = doc
+
+    def find_one(self, spec, *arg, **kw):
+        return dict(self.doc)
+
+
+def test_find_one_cache_non_id_queries():
+    cache = dibble.cache.LRUCache()
+    users = dibble.mapper.ModelMapper(UserModel, SingleDocumentCollection({'_id': 'abc', 'name': 'test'}),
+                                      cache=cache)
+
+    eq_(users.find_one({'_id': re.compile('^a')}).name.value, 'test')
+    eq_(users.find_one({'_id': ['abc']}).name.value, 'test')
+    eq_(users.find_one({'_id': {'$in': ['abc']}}).name.value, 'test')
+    eq_(len(cache), 0)
+
+    users.find_one({'_id': 'abc'})
+    users._invalidate({'_id': re.compile('^a')})
+    eq_(len(cache), 0)
+
+
+class TaggingMapper(dibble.mapper.ModelMapper):
+    def __call__(self, *arg, **kw):
+        model = super(TaggingMapper, self).__call__(*arg, **kw)
+        model.tagged = True
+
+        return model
+
+
+def test_hydrate_batch_custom_call():
+    mapper = TaggingMapper(UserModel, None)
+    models = mapper._hydrate_batch([{'name': 'a'}, {'name': 'b'}], frozenset())
+
+    eq_([m.name.value for m in models], ['a', 'b'])
+    eq_([m.tagged for m in models], [True, True])
+
+
+def test_session_unhashable_id():
+    users = dibble.mapper.ModelMapper(UserModel, None)
+
+    with users.session() as identity_map:
+        user = users._hydrate({'_id': {'a': 1}, 'name': 'test'}, frozenset())
+        eq_(user._id.value, {'a': 1})
+        assert users._hydrate({'_id': {'a': 1}, 'name': 'test'}, frozenset()) is not user
+        eq_(len(identity_map), 0)
+
+
+@with_setup(setup_db)
+def test_find_one_cache():
+    db = get_db()
+    cache = dibble.cache.LRUCache()
+    users = dibble.mapper.ModelMapper(AdvancedUserModel, db.user, cache=cache)
+    uid = users.save({'logincount': 1})
+
+    eq_(users.find_one({'_id': uid})['logincount'], 1)
+    eq_(users.find_one({'_id': uid})['logincount'], 1)
+    eq_((cache.hits, cache.misses), (1, 1))
+
+    user = users.find_one({'_id': uid})
+    user.logincount.inc(1)
+    user.save()
+
+    eq_(len(cache), 0)
+    eq_(users.find_one({'_id': uid})['logincount'], 2)
+
+    users.update({'logincount': 2}, {'$inc': {'logincount': 1}})
+
+    eq_(len(cache), 0)
+    eq_(users.find_one({'_id': uid})['logincount'], 3)
+
+
 @with_setup(setup_db)
 def test_modelmapper_model_save():
     db = get_db()
@@ -174,6 +485,217 @@ def test_modelmapper_model_reload_unsaved():
     user.reload()
 
 
+@with_setup(setup_db)
+def test_modelmapper_reload_policy_never():
+    db = get_db()
+    users = dibble.mapper.ModelMapper(AdvancedUserModel, db.user, reload_policy=dibble.model.RELOAD_NEVER)
+
+    user = users()
+    user.username.set('Foo Bar')
+    user.save()
+
+    users.collection.update({}, {'$set': {'username': 'Fumm Fumm'}})
+
+    eq_(user.username.value, 'Foo Bar')
+
+    user.reload()
+
+    eq_(user.username.value, 'Fumm Fumm')
+
+
+@with_setup(setup_db)
+def test_modelmapper_reload_policy_find_and_modify():
+    db = get_db()
+    users = dibble.mapper.ModelMapper(AdvancedUserModel, db.user,
+                                      reload_policy=dibble.model.RELOAD_FIND_AND_MODIFY)
+
+    user = users()
+    user.username.set('Foo Bar')
+    user.save()
+
+    users.collection.update({}, {'$set': {'username': 'Fumm Fumm'}})
+
+    user.logincount.inc(1)
+    user.save()
+
+    eq_(user._requires_reload, False)
+    eq_(dict(user._update), {})
+    eq_(user.username.value, 'Fumm Fumm')
+    eq_(user.logincount.value, 1)
+
+
+@with_setup(setup_db)
+@raises(ValueError)
+def test_modelmapper_reload_policy_unknown():
+    db = get_db()
+    users = dibble.mapper.ModelMapper(AdvancedUserModel, db.user, reload_policy='sometimes')
+    users().save()
+
+
+@with_setup(setup_db)
+def test_modelmapper_partial_reload():
+    db = get_db()
+    mapper = dibble.mapper.ModelMapper(ReloadTestModel, db.reloadtest)
+
+    m = mapper({'counter': 1, 'foo': {'a': 1, 'b': 2}, 'bar': 'bar'})
+    m.save()
+    m.reload()
+
+    mapper.collection.update({}, {'$set': {'bar': 'baz', 'foo.a': 10, 'foo.b': 20}})
+
+    m.counter.inc(1)
+    m.foo['a'].inc(1)
+    m.save()
+
+    eq_(m._reload_paths, set(['counter', 'foo.a']))
+    eq_(m.counter.value, 2)
+    eq_(m.foo.value, {'a': 11, 'b': 2})
+    eq_(m.bar.value, 'bar')
+    eq_(m._requires_reload, False)
+
+
+@with_setup(setup_db)
+def test_modelmapper_save_all():
+    db = get_db()
+    mapper = dibble.mapper.ModelMapper(ReloadTestModel, db.reloadtest)
+
+    models = [mapper(counter=i) for i in range(3)]
+    oids = mapper.save_all(models)
+
+    eq_(oids, [m._id.value for m in models])
+    eq_(mapper.count(), 3)
+
+    for m in models:
+        m.counter.inc(10)
+
+    new = ReloadTestModel(counter=100)
+    mapper.save_all(models + [new])
+
+    eq_(new._mapper, mapper)
+    eq_(sorted(x['counter'] for x in mapper.collection.find()), [10, 11, 12, 100])
+    eq_([dict(m._update) for m in models], [{}, {}, {}])
+
+
+class FailingBulkCollection(object):
+    """inserts documents with consecutive ids and applies bulk updates except those of the `failing` ids, which
+    are reported by a BulkWriteError. Raises `error` instead if given.
+    """
+    def __init__(self, failing=(), error=None):
+        self.failing = failing
+        self.error = error
+        self.inserted = []
+        self.applied = []
+
+    def insert(self, docs, **kw):
+        self.inserted.extend(docs)
+        return range(len(self.inserted) - len(docs), len(self.inserted))
+
+    def initialize_unordered_bulk_op(self):
+        return FailingBulk(self, False)
+
+    def initialize_ordered_bulk_op(self):
+        return FailingBulk(self, True)
+
+
+class FailingBulk(object):
+    def __init__(self, collection, ordered):
+        self.collection = collection
+        self.ordered = ordered
+        self.ops = []
+
+    def find(self, spec):
+        bulk = self
+
+        class Op(object):
+            def update_one(self, doc):
+                bulk.ops.append((spec['_id'], doc))
+
+        return Op()
+
+    def execute(self, write_concern=None):
+        if self.collection.error is not None:
+            raise self.collection.error
+
+        errors = []
+
+        for i, (oid, doc) in enumerate(self.ops):
+            if oid in self.collection.failing:
+                errors.append({'index': i, 'code': 2, 'errmsg': 'failed'})
+
+                if self.ordered:
+                    break
+
+            else:
+                self.collection.applied.append((oid, doc))
+
+        if errors:
+            raise pymongo.errors.BulkWriteError({'writeErrors': errors})
+
+
+def test_modelmapper_save_all_bulk_failure():
+    mapper = dibble.mapper.ModelMapper(ReloadTestModel, FailingBulkCollection(failing=['failing']),
+                                       reload_policy=dibble.model.RELOAD_NEVER)
+    failing = mapper({'_id': 'failing', 'counter': 1})
+    failing.counter.inc(1)
+    existing = mapper({'_id': 'existing', 'counter': 1})
+    existing.counter.inc(2)
+    new = mapper(counter=5)
+
+    try:
+        mapper.save_all([failing, existing, new])
+
+    except pymongo.errors.BulkWriteError:
+        pass
+
+    eq_(new._id.value, 0)
+    eq_(new.is_new, False)
+    eq_(failing._update.documents(), [{'$inc': {'counter': 1}}])
+    eq_(existing._update.documents(), [])
+    eq_(mapper.collection.applied, [('existing', {'$inc': {'counter': 2}})])
+    eq_(len(mapper.collection.inserted), 1)
+
+
+def test_modelmapper_save_all_unknown_failure():
+    mapper = dibble.mapper.ModelMapper(ReloadTestModel, FailingBulkCollection(error=IOError('connection lost')),
+                                       reload_policy=dibble.model.RELOAD_NEVER)
+    existing = mapper({'_id': 'existing', 'counter': 1})
+    existing.counter.inc(1)
+
+    try:
+        mapper.save_all([existing])
+
+    except IOError:
+        pass
+
+    eq_(existing._update.documents(), [])
+    eq_((existing._requires_reload, existing._reload_paths), (True, None))
+
+
+@with_setup(setup_db)
+def test_modelmapper_insert_many():
+    db = get_db()
+    mapper = dibble.mapper.ModelMapper(ReloadTestModel, db.reloadtest)
+    models = []
+
+    def generate():
+        for i in range(7):
+            if i % 2:
+                yield {'counter': i}
+
+            else:
+                m = ReloadTestModel(counter=i)
+                models.append(m)
+                yield m
+
+    eq_(mapper.insert_many(generate(), batch_size=3), 7)
+    eq_(mapper.count(), 7)
+    eq_(len(models), 4)
+
+    for m in models:
+        eq_(m._mapper, mapper)
+        eq_(mapper.collection.find_one({'_id': m._id.value})['counter'], m.counter.value)
+
+
 @with_setup(setup_db)
 def test_modelmapper_custom_id():
     db = get_db()
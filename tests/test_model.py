@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import threading
 import dibble.fields
 import dibble.model
 from nose.tools import raises, eq_, assert_false, assert_true
@@ -14,6 +15,12 @@ class SimpleModel(dibble.model.Model):
     xdict = dibble.fields.Field()
 
 
+class LazyModel(SimpleModel):
+    lazy_fields = True
+
+    xdefault = dibble.fields.Field(default=42)
+
+
 class PropertyModel(dibble.model.Model):
     @property
     def prop(self):
@@ -72,6 +79,147 @@ def test_inheritance():
     assert isinstance(m.ydict, dibble.fields.Field)
 
 
+def test_field_registry():
+    names = [name for name, _ in SimpleModel._unbound_fields]
+
+    eq_(names, ['_id', 'xbool', 'xbytes', 'xdict', 'xfloat', 'xint', 'xlist', 'xunicode'])
+
+
+def test_field_registry_override():
+    class OverrideModel(SimpleModel):
+        xint = None
+        xlist = dibble.fields.Field(default=list)
+
+        @property
+        def xbool(self):
+            return True
+
+    names = [name for name, _ in OverrideModel._unbound_fields]
+
+    assert_true('xint' not in names)
+    assert_true('xbool' not in names)
+    assert_true(dict(OverrideModel._unbound_fields)['xlist'] is OverrideModel.xlist)
+
+    m = OverrideModel()
+
+    assert_true(m.xbool)
+    eq_(m.xlist.value, [])
+    assert_true('xint' not in m._fields)
+
+
+def test_field_registry_class_update():
+    class TestModel(dibble.model.Model):
+        a = dibble.fields.Field()
+
+    class InheritedModel(TestModel):
+        pass
+
+    TestModel.b = dibble.fields.Field()
+
+    assert_true(isinstance(InheritedModel().b, dibble.fields.Field))
+
+    del TestModel.b
+
+    assert_true('b' not in InheritedModel()._fields)
+
+
+def test_lazy_binding():
+    m = LazyModel({'xint': 1, 'xlist': [1, 2]})
+
+    eq_(m._fields, {})
+
+    eq_(m.xint.value, 1)
+    eq_(sorted(m._fields.keys()), ['xint'])
+    assert_true(m.xint is m._fields['xint'])
+
+    eq_(m['xlist'], [1, 2])
+    eq_(sorted(m._fields.keys()), ['xint', 'xlist'])
+    assert_true(isinstance(LazyModel.xbool, dibble.fields.UnboundField))
+
+
+def test_lazy_iter():
+    m = LazyModel({'xint': 1, 'xlist': [1, 2]})
+    m.xint.inc(1)
+
+    eq_(dict(m), {'xint': 2, 'xlist': [1, 2], 'xdefault': 42})
+    assert_true('xlist' not in m._fields)
+
+
+def test_lazy_update():
+    m = LazyModel({'xint': 1})
+    m.xbool.set(True)
+    m.xint.inc(1)
+
+    eq_(dict(m._update), {'$set': {'xbool': True}, '$inc': {'xint': 1}})
+
+
+@raises(dibble.model.UndefinedFieldError)
+def test_lazy_getitem_undefined_field():
+    m = LazyModel()
+    m['xint']
+
+
+def test_from_documents():
+    models = SimpleModel._from_documents([{'xint': 1}, {'xint': 2}], 'mapper')
+
+    eq_([m.xint.value for m in models], [1, 2])
+    eq_([m._mapper for m in models], ['mapper', 'mapper'])
+
+    models = LazyModel._from_documents([{'xint': 3}], 'mapper')
+    eq_(dict(models[0]), {'xint': 3, 'xdefault': 42})
+
+
+def test_lazy_delattr():
+    m = LazyModel({'xint': 1})
+    del m.xint
+
+    assert_false(hasattr(m, 'xint'))
+    eq_(dict(m), {'xdefault': 42})
+
+
+def test_load_paths():
+    m = SimpleModel({'xint': 1, 'xdict': {'a': {'b': 1, 'c': 2}, 'd': 3}, 'xlist': [1]})
+    sf = m.xdict['a']['b']
+
+    m._load_paths({'xint': 5, 'xdict': {'a': {'b': 10}}}, ['xint', 'xdict.a.b', 'xdict.d', 'xlist'])
+
+    eq_(m.xint.value, 5)
+    eq_(m.xdict.value, {'a': {'b': 10, 'c': 2}})
+    eq_(sf.value, 10)
+    assert_false(m.xlist.defined)
+
+
+def test_lazy_load_paths():
+    m = LazyModel({'xint': 1, 'xdict': {'a': 1, 'b': 2}})
+
+    m._load_paths({'xint': 5, 'xdict': {'a': 10}}, ['xint', 'xdict.a'])
+
+    eq_(m._fields, {})
+    eq_(m['xint'], 5)
+    eq_(m['xdict'], {'a': 10, 'b': 2})
+
+
+def test_unloaded_fields():
+    class TestModel(SimpleModel):
+        fetch_unloaded = False
+
+    m = TestModel({'xint': 1})
+    m._set_unloaded(['xbool', 'xlist'])
+
+    eq_(dict(m), {'xint': 1})
+    assert_false('xbool' in m._fields)
+
+
+@raises(dibble.model.UnloadedFieldError)
+def test_unloaded_field_access():
+    class TestModel(SimpleModel):
+        fetch_unloaded = False
+
+    m = TestModel({'xint': 1})
+    m._set_unloaded(['xbool'])
+    m.xbool
+
+
 def test_update():
     class TestModel(dibble.model.Model):
         counter = dibble.fields.Field()
@@ -83,7 +231,7 @@ def test_update():
 
     m.counter.inc(1)
 
-    eq_(dict(m._update), {'$set': {'counter': 1}, '$inc': {'counter': 1}})
+    eq_(dict(m._update), {'$set': {'counter': 2}})
 
 
 def test_defined():
@@ -191,6 +339,16 @@ def test_delattr_defined_field():
     assert_false(hasattr(m, 'xint'))
 
 
+def test_delattr_field_readd():
+    m = SimpleModel({'xint': 1})
+    del m.xint
+    assert_true('xint' not in dict(m))
+
+    m.xint = dibble.fields.Field(_name='xint', _model=m, _initial=2)
+    eq_(m.xint.value, 2)
+    eq_(dict(m)['xint'], 2)
+
+
 def test_delattr_defined():
     m = SimpleModel()
     del m._mapper
@@ -227,3 +385,212 @@ def test_model_repr():
     assert_true(r.startswith('<SimpleModel({'))
     assert_true(r.endswith('})>'))
     eq_(r[13:-2], repr(dict(m)))
+
+
+def test_model_view():
+    v = dibble.model.ModelView(SimpleModel, {'_id': 1, 'xint': 5, 'notafield': True})
+
+    eq_(v['xint'], 5)
+    eq_(dict(v), {'_id': 1, 'xint': 5})
+    eq_(v.get('xbool', False), False)
+    assert_true('xint' in v)
+    assert_false('notafield' in v)
+    assert_true(repr(v).startswith('<SimpleModelView({'))
+
+
+@raises(dibble.model.UndefinedFieldError)
+def test_model_view_undefined_field():
+    v = dibble.model.ModelView(SimpleModel, {'xint': 5})
+    v['xbool']
+
+
+@raises(KeyError)
+def test_model_view_unknown_field():
+    v = dibble.model.ModelView(SimpleModel, {'notafield': 5})
+    v['notafield']
+
+
+class CountingMapper(object):
+    """records the increments sent by update calls"""
+    reload_policy = dibble.model.RELOAD_NEVER
+
+    def __init__(self, fail=False):
+        self.total = 0
+        self.fail = fail
+
+    def update(self, spec, doc, *arg, **kw):
+        if self.fail:
+            raise IOError('update failed')
+
+        self.total += doc.get('$inc', {}).get('counter', 0)
+
+
+class TimestampMixin(object):
+    created = dibble.fields.Field()
+
+
+class MixinModel(TimestampMixin, dibble.model.Model):
+    name = dibble.fields.Field()
+
+
+def test_mixin_fields():
+    m = MixinModel({'name': 'foo', 'created': 1})
+
+    eq_(m['created'], 1)
+    eq_(m.created.value, 1)
+    eq_(dict(m), {'name': 'foo', 'created': 1})
+    eq_(MixinModel._field_names, frozenset(['_id', 'name', 'created']))
+
+    m.created.set(2)
+    eq_(m._update.documents(), [{'$set': {'created': 2}}])
+
+
+class FindAndModifyMapper(object):
+    """records the arguments of find_and_modify calls"""
+    reload_policy = dibble.model.RELOAD_FIND_AND_MODIFY
+
+    def __init__(self):
+        self.calls = []
+
+    def find_and_modify(self, spec, doc, *arg, **kw):
+        self.calls.append((spec, doc, arg, kw))
+
+
+def test_save_find_and_modify_write_concern():
+    mapper = FindAndModifyMapper()
+    m = SimpleModel({'_id': 1, 'xint': 0})
+    m.bind(mapper)
+    m.xint.inc(1)
+
+    m.save(safe=False, w=0)
+
+    eq_(mapper.calls, [({'_id': 1}, {'$inc': {'xint': 1}}, (), {'new': True, 'readonly': True})])
+
+
+class NestedModel(dibble.model.Model):
+    foo = dibble.fields.Field()
+    bar = dibble.fields.Field()
+
+
+class ReloadingMapper(object):
+    """answers reloads with a fixed document and records the requested fields"""
+    reload_policy = dibble.model.RELOAD_LAZY
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.fields = []
+
+    def find_one(self, spec, fields=None, **kw):
+        self.fields.append(fields)
+
+        return dibble.model.ModelView(NestedModel, self.doc)
+
+
+def test_reload_collapses_paths():
+    mapper = ReloadingMapper({'_id': 1, 'foo': {'a': 2, 'b': {'c': 2}}, 'bar': {'x': 2, 'y': 2}})
+    m = NestedModel({'_id': 1, 'foo': {'a': 1, 'b': {'c': 1}}, 'bar': {'x': 1, 'y': 1}})
+    m.bind(mapper)
+    m._requires_reload = True
+    m._reload_paths = set(['foo', 'foo.a', 'foo.b.c', 'bar.x'])
+
+    m.reload(force=False)
+
+    eq_(mapper.fields, [['bar.x', 'foo']])
+    eq_(m.foo.value, {'a': 2, 'b': {'c': 2}})
+    eq_(m.bar.value, {'x': 2, 'y': 1})
+
+
+class ThreadSafeModel(dibble.model.Model):
+    thread_safe = True
+    counter = dibble.fields.Field()
+
+
+def test_thread_safe_save():
+    mapper = CountingMapper()
+    m = ThreadSafeModel({'_id': 1, 'counter': 0})
+    m.bind(mapper)
+
+    def work():
+        for _ in range(500):
+            m.counter.inc(1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+
+    for t in threads:
+        t.start()
+
+    while any(t.is_alive() for t in threads):
+        m.save()
+
+    m.save()
+
+    eq_(mapper.total, 2000)
+    eq_(m.counter.value, 2000)
+    assert_false(m._update.dirty)
+
+
+class StoreMapper(object):
+    """applies updates to a single stored document, calling `during_write` while a save is in flight"""
+    reload_policy = None
+
+    def __init__(self, doc, during_write=None):
+        self.doc = doc
+        self.during_write = during_write
+
+    def update(self, spec, doc, *arg, **kw):
+        for field, value in doc.get('$inc', {}).items():
+            self.doc[field] = self.doc.get(field, 0) + value
+
+        if self.during_write is not None:
+            during_write, self.during_write = self.during_write, None
+            during_write()
+
+    def find_and_modify(self, spec, doc, *arg, **kw):
+        self.update(spec, doc)
+
+        return dibble.model.ModelView(ThreadSafeModel, dict(self.doc))
+
+    def find_one(self, spec, fields=None, **kw):
+        return dibble.model.ModelView(ThreadSafeModel, dict(self.doc))
+
+
+def concurrent_save(policy):
+    m = ThreadSafeModel({'_id': 1, 'counter': 0})
+    mapper = StoreMapper({'_id': 1, 'counter': 0}, during_write=lambda: m.counter.inc(10))
+    mapper.reload_policy = policy
+    m.bind(mapper)
+
+    m.counter.inc(1)
+    m.save()
+    m.counter.inc(100)
+    m.save()
+
+    eq_(mapper.doc['counter'], 111)
+    eq_(m.counter.value, 111)
+
+
+def test_concurrent_save_lazy_reload():
+    concurrent_save(dibble.model.RELOAD_LAZY)
+
+
+def test_concurrent_save_find_and_modify():
+    concurrent_save(dibble.model.RELOAD_FIND_AND_MODIFY)
+
+
+def test_concurrent_save_no_reload():
+    concurrent_save(dibble.model.RELOAD_NEVER)
+
+
+def test_save_failure_restores_updates():
+    m = ThreadSafeModel({'_id': 1, 'counter': 0})
+    m.bind(CountingMapper(fail=True))
+    m.counter.inc(2)
+
+    try:
+        m.save()
+
+    except IOError:
+        pass
+
+    m.counter.inc(3)
+    eq_(m._update.documents(), [{'$inc': {'counter': 5}}])
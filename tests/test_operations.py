@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from nose.tools import raises, eq_, assert_false
+from nose.tools import raises, eq_, assert_false, assert_true
 import dibble.fields
 import dibble.model
 import dibble.operations
@@ -109,6 +109,46 @@ def test_push():
     eq_(m.tags.value, ['foo', 'bar', 'baz'])
 
 
+def test_push_repeated():
+    initial = ['foo']
+    m = ListFieldTestModel(tags=initial)
+    m.tags.push('bar')
+    value = m.tags.value
+    m.tags.push('baz')
+
+    assert_true(m.tags.value is value)
+    eq_(m.tags.value, ['foo', 'bar', 'baz'])
+    eq_(initial, ['foo'])
+    eq_(dict(m._update), {'$push': {'tags': {'$each': ['bar', 'baz']}}})
+
+    m.tags.reset()
+    m.tags.push('fumm')
+
+    eq_(m.tags.value, ['foo', 'fumm'])
+    eq_(initial, ['foo'])
+    eq_(dict(m._update), {'$push': {'tags': 'fumm'}})
+
+
+def test_push_after_set():
+    values = ['foo']
+    m = ListFieldTestModel()
+    m.tags.set(values)
+    m.tags.push('bar')
+
+    eq_(values, ['foo'])
+    eq_(m.tags.value, ['foo', 'bar'])
+
+
+def test_push_subfield():
+    m = ListFieldTestModel(tags={'list': ['foo']})
+    sf = m.tags['list']
+    sf.push('bar')
+    sf.push('baz')
+
+    eq_(m.tags.value, {'list': ['foo', 'bar', 'baz']})
+    eq_(dict(m._update), {'$push': {'tags.list': {'$each': ['bar', 'baz']}}})
+
+
 def test_push_all():
     m = ListFieldTestModel()
     m.tags.push_all(['fumm', 'fnorb'])
@@ -123,6 +163,20 @@ def test_push_all():
     eq_(m.tags.value, ['foo', 'bar', 'baz'])
 
 
+def test_push_all_repeated():
+    initial = ['foo']
+    values = ['bar']
+    m = ListFieldTestModel(tags=initial)
+    m.tags.push_all(values)
+    m.tags.push_all(['baz'])
+    m.tags.push_all(['fumm'])
+
+    eq_(m.tags.value, ['foo', 'bar', 'baz', 'fumm'])
+    eq_(initial, ['foo'])
+    eq_(values, ['bar'])
+    eq_(dict(m._update), {'$pushAll': {'tags': ['bar', 'baz', 'fumm']}})
+
+
 def test_add_to_set():
     m = ListFieldTestModel(tags=['foo'])
     m.tags.add_to_set('foo')
@@ -143,6 +197,26 @@ def test_add_to_set():
     eq_(m.tags.value, ['foo', 'bar', 'baz'])
 
 
+def test_add_to_set_mixed_items():
+    initial = [1, {'a': 1}, [1, 2]]
+    m = ListFieldTestModel(tags=initial)
+    m.tags.add_to_set({'$each': [True, 1.0, {'a': 1}, {'a': 2}, [1, 2], 'foo', 'foo']})
+
+    eq_(m.tags.value, [1, {'a': 1}, [1, 2], True, {'a': 2}, 'foo'])
+    eq_(initial, [1, {'a': 1}, [1, 2]])
+
+
+def test_itemset():
+    items = dibble.operations.ItemSet([1, 'foo', {'a': 1}])
+
+    assert_true(1 in items)
+    assert_true(1.0 in items)
+    assert_false(True in items)
+    assert_true({'a': 1} in items)
+    assert_false({'a': 2} in items)
+    assert_false([1] in items)
+
+
 def test_pop():
     m = ListFieldTestModel(tags=['foo', 'bar'])
     m.tags.pop()
@@ -183,3 +257,10 @@ def test_pull_all():
 
     eq_(dict(m._update), {'$pullAll': {'tags': ['foo', 'bar']}})
     eq_(m.tags.value, ['baz'])
+
+
+def test_pull_all_mixed_items():
+    m = ListFieldTestModel(tags=[1, True, {'a': 1}, {'a': 2}, 'foo', 1.0])
+    m.tags.pull_all([1, {'a': 1}, 'bar'])
+
+    eq_(m.tags.value, [True, {'a': 2}, 'foo'])
@@ -186,3 +186,54 @@ def test_subfield_reset_invalidate():
 def test_subfield_of_simple_value():
     tm = TestModel({'foo': 'bar'})
     sf = tm.foo['baz']
+
+
+def test_subfield_update_fold():
+    tm = TestModel()
+    tm.foo.set({'bar': 1})
+    tm.foo['bar'].inc(1)
+    tm.foo['baz'].set('qux')
+
+    eq_(tm._update.documents(), [{'$set': {'foo': {'bar': 2, 'baz': 'qux'}}}])
+    eq_(tm.foo.value, {'bar': 2, 'baz': 'qux'})
+
+
+def test_subfield_name_rename():
+    tm = TestModel()
+    sf = tm.foo['bar']['baz']
+
+    eq_(sf.name, 'foo.bar.baz')
+    eq_(sf.parents, (tm.foo['bar'], tm.foo))
+
+    tm.foo.rename('qux')
+    eq_(sf.name, 'qux.bar.baz')
+
+
+def test_subfield_setvalue_replaced_parent():
+    tm = TestModel()
+    sf = tm.foo['bar']['baz']
+    sf.inc(1)
+    sf.inc(1)
+
+    eq_(tm.foo.value, {'bar': {'baz': 2}})
+
+    tm.foo['bar'].set({'baz': 5, 'qux': 1})
+    sf = tm.foo['bar']['baz']
+    sf.inc(1)
+
+    eq_(tm.foo.value, {'bar': {'baz': 6, 'qux': 1}})
+
+
+def test_subfield_setvalue_after_parent_reset():
+    tm = TestModel({'foo': {'a': {'x': 1}}})
+    sf = tm.foo['a']['x']
+    sf.set(2)
+    tm.foo.reset()
+
+    eq_(tm.foo.value, {'a': {'x': 1}})
+    eq_(sf.value, 1)
+
+    sf.set(3)
+
+    eq_(tm.foo.value, {'a': {'x': 3}})
+    eq_(tm._update.documents(), [{'$set': {'foo.a.x': 3}}])
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from nose.tools import raises, assert_true, assert_false
+from nose.tools import raises, eq_, assert_true, assert_false
 import dibble.update
 
 
@@ -34,3 +34,192 @@ def test_contains():
 
     assert_true('foo' in u)
     assert_false('bar' in u)
+
+
+def test_push_merge():
+    u = dibble.update.Update()
+    u.push('foo', 1)
+    u.push('foo', {'$each': [2, 3]})
+    u.push('foo', 4)
+
+    eq_(dict(u), {'$push': {'foo': {'$each': [1, 2, 3, 4]}}})
+
+
+def test_push_merge_modifiers():
+    u = dibble.update.Update()
+    u.push('foo', {'$each': [1], '$slice': -5})
+    u.push('foo', 2)
+
+    eq_(u.documents(), [{'$push': {'foo': {'$each': [1], '$slice': -5}}}, {'$push': {'foo': 2}}])
+
+
+def test_inc_merge():
+    u = dibble.update.Update()
+    u.inc('foo', 1)
+    u.inc('foo', 2)
+
+    eq_(u.documents(), [{'$inc': {'foo': 3}}])
+
+
+def test_set_replaces():
+    u = dibble.update.Update()
+    u.inc('foo', 1)
+    u.push('bar', 1)
+    u.set('foo', 5)
+    u.unset('bar')
+
+    eq_(u.documents(), [{'$set': {'foo': 5}, '$unset': {'bar': 1}}])
+
+
+def test_set_fold():
+    value = [1]
+    u = dibble.update.Update()
+    u.set('foo', value)
+    u.push('foo', 2)
+    u.pushAll('foo', [3, 4])
+    u.addToSet('foo', 1)
+
+    eq_(u.documents(), [{'$set': {'foo': [1, 2, 3, 4]}}])
+    eq_(value, [1])
+
+
+def test_addtoset_merge():
+    u = dibble.update.Update()
+    u.addToSet('foo', 1)
+    u.addToSet('foo', {'$each': [1, 2, {'a': 1}]})
+    u.addToSet('foo', {'a': 1})
+
+    eq_(u.documents(), [{'$addToSet': {'foo': {'$each': [1, 2, {'a': 1}]}}}])
+
+
+def test_split():
+    u = dibble.update.Update()
+    u.push('foo', 1)
+    u.pop('foo')
+    u.push('foo', 2)
+    u.inc('bar', 1)
+
+    eq_(u.documents(), [{'$push': {'foo': 1}}, {'$pop': {'foo': 1}}, {'$push': {'foo': 2}, '$inc': {'bar': 1}}])
+    eq_(dict(u), {'$push': {'foo': 1}})
+    assert_true('bar' in u)
+
+    u.drop_field('foo')
+    eq_(u.documents(), [{'$inc': {'bar': 1}}])
+
+
+def test_rename_split():
+    u = dibble.update.Update()
+    u.rename('foo', 'bar')
+    u.set('bar', 1)
+
+    eq_(u.documents(), [{'$rename': {'foo': 'bar'}}, {'$set': {'bar': 1}}])
+
+
+def test_subfield_fold():
+    value = {'bar': {'baz': 1}}
+    u = dibble.update.Update()
+    u.set('foo', value)
+    u.inc('foo.bar.baz', 2)
+    u.set('foo.qux', [1])
+    u.push('foo.qux', 2)
+    u.unset('foo.bar')
+
+    eq_(u.documents(), [{'$set': {'foo': {'qux': [1, 2]}}}])
+    eq_(value, {'bar': {'baz': 1}})
+
+
+def test_subfield_conflict_split():
+    u = dibble.update.Update()
+    u.inc('foo.bar', 1)
+    u.inc('foo', 1)
+    u.pop('baz.qux')
+    u.pull('baz', 1)
+
+    eq_(u.documents(), [{'$inc': {'foo.bar': 1}}, {'$inc': {'foo': 1}, '$pop': {'baz.qux': 1}}, {'$pull': {'baz': 1}}])
+
+
+def test_set_replaces_subfields():
+    u = dibble.update.Update()
+    u.inc('foo.bar', 1)
+    u.push('foo.baz', 1)
+    u.inc('foobar', 1)
+    u.set('foo', {})
+
+    eq_(u.documents(), [{'$inc': {'foobar': 1}, '$set': {'foo': {}}}])
+
+
+def test_rename_conflict_split():
+    u = dibble.update.Update()
+    u.set('foo.bar', 1)
+    u.rename('foo', 'baz')
+    u.inc('baz.qux', 1)
+
+    eq_(u.documents(), [{'$set': {'foo.bar': 1}}, {'$rename': {'foo': 'baz'}}, {'$inc': {'baz.qux': 1}}])
+
+
+def test_pathtrie():
+    t = dibble.update.PathTrie()
+    t.add('foo.bar', '$set')
+    t.add('foo.bar.baz', '$inc')
+
+    eq_(t.get('foo.bar'), set(['$set']))
+    eq_(t.ancestor('foo.bar.baz'), ('foo.bar', set(['$set'])))
+    eq_(t.ancestor('foo.bar'), None)
+    assert_true(t.has_descendants('foo'))
+    eq_(sorted(t.items('foo')), [('foo.bar', set(['$set'])), ('foo.bar.baz', set(['$inc']))])
+
+    t.discard('foo.bar.baz', '$inc')
+    t.discard('foo.bar', '$set')
+    assert_false(t)
+
+
+def test_drop_field_index():
+    u = dibble.update.Update()
+    assert_false(u.dirty)
+
+    u.push('foo', 1)
+    u.pop('foo')
+    u.inc('bar', 1)
+    assert_true(u.dirty)
+    assert_true('foo' in u)
+
+    u.drop_field('foo')
+    assert_false('foo' in u)
+    eq_(u.documents(), [{'$inc': {'bar': 1}}])
+
+    u.inc('bar', 1)
+    eq_(u.documents(), [{'$inc': {'bar': 2}}])
+
+    u.drop_field('bar')
+    assert_false(u.dirty)
+    eq_(u.documents(), [])
+
+
+def test_empty():
+    u = dibble.update.Update()
+
+    eq_(dict(u), {})
+    eq_(u.documents(), [])
+    assert_false('foo' in u)
+
+    u.drop_field('foo')
+    u.set('foo', 1)
+    u.clear()
+    assert_false(u.dirty)
+    eq_(dict(u), {})
+
+
+def test_take_restore():
+    u = dibble.update.Update()
+    u.inc('foo', 1)
+    u.pop('bar')
+
+    taken = u.take()
+    eq_(taken, [{'$inc': {'foo': 1}, '$pop': {'bar': 1}}])
+    assert_false(u.dirty)
+
+    u.inc('foo', 2)
+    u.push('bar', 1)
+    u.restore(taken)
+
+    eq_(u.documents(), [{'$inc': {'foo': 3}, '$pop': {'bar': 1}}, {'$push': {'bar': 1}}])
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import time
+import pymongo
+from nose.tools import eq_, raises, assert_false
+import dibble.fields
+import dibble.mapper
+import dibble.model
+import dibble.writebehind
+
+
+class CounterModel(dibble.model.Model):
+    hits = dibble.fields.Field()
+    tags = dibble.fields.Field()
+
+
+class FakeBulk(object):
+    def __init__(self, collection, ordered):
+        self.collection = collection
+        self.ordered = ordered
+        self.ops = []
+
+    def find(self, spec):
+        bulk = self
+
+        class Op(object):
+            def update_one(self, doc):
+                bulk.ops.append((spec['_id'], doc))
+
+        return Op()
+
+    def execute(self, write_concern=None):
+        if self.collection.error is not None:
+            raise self.collection.error
+
+        applied, errors = [], []
+
+        for i, (oid, doc) in enumerate(self.ops):
+            if oid in self.collection.failing:
+                errors.append({'index': i, 'code': 2, 'errmsg': 'failed'})
+
+                if self.ordered:
+                    break
+
+            else:
+                applied.append((oid, doc))
+
+        self.collection.executed.append(applied)
+
+        if errors:
+            raise pymongo.errors.BulkWriteError({'writeErrors': errors})
+
+
+class FakeCollection(object):
+    """records the bulk updates applied by the write-behind buffer. Updates of the `failing` ids fail with a
+    BulkWriteError, all updates fail with `error` if it is set.
+    """
+    def __init__(self):
+        self.executed = []
+        self.failing = ()
+        self.error = None
+
+    def initialize_ordered_bulk_op(self):
+        return FakeBulk(self, True)
+
+    def initialize_unordered_bulk_op(self):
+        return FakeBulk(self, False)
+
+
+def get_mapper(**kw):
+    kw.setdefault('interval', None)
+    kw.setdefault('flush_at_exit', False)
+    wb = dibble.writebehind.WriteBehind(**kw)
+
+    return dibble.mapper.ModelMapper(CounterModel, FakeCollection(), write_behind=wb)
+
+
+def test_merge_and_flush():
+    mapper = get_mapper()
+    m = mapper({'_id': 1, 'hits': 0, 'tags': []})
+
+    for _ in range(3):
+        m.hits.inc(1)
+        m.save()
+
+    m.tags.add_to_set('a')
+    m.save()
+
+    other = mapper({'_id': 2, 'hits': 0})
+    other.hits.inc(5)
+    other.save()
+
+    eq_(len(mapper.write_behind), 2)
+    eq_(mapper.collection.executed, [])
+    eq_(mapper.write_behind.flush(), 2)
+    expected = [(1, {'$inc': {'hits': 3}, '$addToSet': {'tags': 'a'}}), (2, {'$inc': {'hits': 5}})]
+    eq_(sorted(mapper.collection.executed[0]), expected)
+    eq_(mapper.write_behind.flush(), 0)
+    eq_(m.hits.value, 3)
+
+
+def test_max_pending():
+    mapper = get_mapper(max_pending=2)
+
+    for oid in range(3):
+        m = mapper({'_id': oid})
+        m.hits.inc(1)
+        m.save()
+
+    eq_(len(mapper.collection.executed), 1)
+    eq_(len(mapper.write_behind), 1)
+
+
+def test_failed_flush_keeps_updates():
+    mapper = get_mapper()
+    m = mapper({'_id': 1, 'hits': 0})
+    m.hits.inc(1)
+    m.save()
+    other = mapper({'_id': 2, 'hits': 0})
+    other.hits.inc(1)
+    other.save()
+    mapper.collection.failing = [1]
+
+    try:
+        mapper.write_behind.flush()
+
+    except pymongo.errors.BulkWriteError:
+        pass
+
+    eq_(mapper.collection.executed, [[(2, {'$inc': {'hits': 1}})]])
+
+    m.hits.inc(2)
+    m.save()
+    mapper.collection.failing = ()
+    mapper.write_behind.flush()
+
+    eq_(mapper.collection.executed[1], [(1, {'$inc': {'hits': 3}})])
+
+
+def test_failed_flush_ordered():
+    mapper = get_mapper()
+    m = mapper({'_id': 1, 'hits': 0, 'tags': []})
+    m.hits.inc(1)
+    m.save()
+    m.tags.push('a')
+    m.tags.pop()
+    m.save()
+    mapper.collection.failing = [1]
+
+    try:
+        mapper.write_behind.flush()
+
+    except pymongo.errors.BulkWriteError:
+        pass
+
+    eq_(mapper.write_behind._pending[1].documents(), [{'$inc': {'hits': 1}, '$push': {'tags': 'a'}},
+                                                      {'$pop': {'tags': 1}}])
+
+
+def test_failed_flush_unknown_error():
+    mapper = get_mapper()
+    m = mapper({'_id': 1, 'hits': 0})
+    m.hits.inc(1)
+    m.save()
+    mapper.collection.error = IOError('connection lost')
+
+    try:
+        mapper.write_behind.flush()
+
+    except IOError:
+        pass
+
+    eq_(len(mapper.write_behind), 0)
+
+
+def test_background_flush_and_close():
+    mapper = get_mapper(interval=0.01)
+    m = mapper({'_id': 1, 'hits': 0})
+    m.hits.inc(1)
+    m.save()
+
+    for _ in range(100):
+        if mapper.collection.executed:
+            break
+
+        time.sleep(0.01)
+
+    eq_(mapper.collection.executed, [[(1, {'$inc': {'hits': 1}})]])
+
+    m.hits.inc(1)
+    m.save()
+    mapper.write_behind.close()
+
+    eq_(len(mapper.collection.executed), 2)
+    assert_false(mapper.write_behind._thread)
+
+
+@raises(ValueError)
+def test_closed():
+    mapper = get_mapper()
+    mapper.write_behind.close()
+
+    m = mapper({'_id': 1, 'hits': 0})
+    m.hits.inc(1)
+
+    try:
+        m.save()
+
+    finally:
+        eq_(m._update.documents(), [{'$inc': {'hits': 1}}])
+
+
+@raises(ValueError)
+def test_save_arguments():
+    mapper = get_mapper()
+    m = mapper({'_id': 1, 'hits': 0})
+    m.hits.inc(1)
+
+    try:
+        m.save(safe=True)
+
+    finally:
+        eq_(len(mapper.write_behind), 0)
+        eq_(m._update.documents(), [{'$inc': {'hits': 1}}])